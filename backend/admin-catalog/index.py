@@ -2,11 +2,33 @@
 Админ-панель: CRUD операции для категорий и товаров каталога.
 Роутинг через query-параметр: ?resource=categories|products&id=123
 Требует заголовок X-Admin-Key для авторизации.
+После изменений публикует статические JSON-снимки каталога (если задан SNAPSHOT_STORE).
 """
+import base64
+import codecs
+import csv
+import gzip
+import io
 import json
+import hashlib
 import os
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from xml.sax.saxutils import escape as xml_escape, quoteattr as xml_quoteattr
+from datetime import datetime, timezone
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor, execute_values
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 CORS_HEADERS = {
@@ -16,8 +38,136 @@ CORS_HEADERS = {
 }
 
 
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+
+class ConnectionPool:
+    """Пул соединений, живущий столько же, сколько тёплый инстанс функции."""
+
+    def __init__(self, minconn, maxconn, ping_after):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.ping_after = ping_after
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'discarded': 0}
+
+    def _connect(self):
+        return psycopg2.connect(os.environ['DATABASE_URL'])
+
+    def _alive(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        with self._lock:
+            if self._in_use >= self.maxconn:
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+            self._in_use += 1
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    break
+                conn, idle_since = item
+                # Проверка соединения (возможно, с пингом) идёт без блокировки, счётчики — под ней.
+                alive = self._alive(conn, idle_since)
+                with self._lock:
+                    if alive:
+                        self.stats['reuses'] += 1
+                    else:
+                        self.stats['discarded'] += 1
+                        self.stats['reconnects'] += 1
+                if alive:
+                    return conn
+                self._discard(conn)
+            conn = self._connect()
+            with self._lock:
+                self.stats['connects'] += 1
+                missing = self.minconn - self._in_use - len(self._idle)
+            for _ in range(max(missing, 0)):
+                extra = self._connect()
+                with self._lock:
+                    self.stats['connects'] += 1
+                    self._idle.append((extra, time.monotonic()))
+            return conn
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+            raise
+
+    def putconn(self, conn, broken=False):
+        with self._lock:
+            self._in_use -= 1
+            keep = not broken and not conn.closed and len(self._idle) < self.maxconn
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self.stats['discarded'] += 1
+        if not keep:
+            self._discard(conn)
+
+    def snapshot(self):
+        with self._lock:
+            total = self.stats['connects'] + self.stats['reuses']
+            return {
+                **self.stats,
+                'hit_rate': round(self.stats['reuses'] / total, 4) if total else 0.0,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'min': self.minconn,
+                'max': self.maxconn,
+            }
+
+
+POOL = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_PING_AFTER)
+
+# Соединение текущего batch-запроса (см. run_batch): пока оно задано, get_conn отдаёт его.
+_batch = threading.local()
+
+
+@contextmanager
 def get_conn():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    shared = getattr(_batch, 'conn', None)
+    if shared is not None:
+        yield shared
+        return
+    conn = POOL.getconn()
+    broken = False
+    try:
+        with conn:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        POOL.putconn(conn, broken=broken or bool(conn.closed))
 
 
 def resp(status, data):
@@ -33,6 +183,51 @@ def check_auth(event):
     return key == os.environ.get('ADMIN_SECRET_KEY', '')
 
 
+# ---- Compression ----
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+
+def get_header(event, name):
+    name = name.lower()
+    for k, v in (event.get('headers') or {}).items():
+        if k.lower() == name:
+            return v
+    return None
+
+
+def negotiate_encoding(accept_encoding):
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, q = part.strip().partition(';q=')
+        try:
+            accepted[name.strip().lower()] = float(q) if q else 1.0
+        except ValueError:
+            continue
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def encode_response(result, encoding):
+    if result['statusCode'] not in (200, 201) or not encoding:
+        return result
+    raw = result['body'].encode()
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return result
+    if encoding == 'br':
+        data = brotli.compress(raw, quality=5)
+    else:
+        data = gzip.compress(raw, compresslevel=6, mtime=0)
+    headers = {**result['headers'], 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+    return {**result, 'headers': headers, 'body': base64.b64encode(data).decode(), 'isBase64Encoded': True}
+
+
 def handler(event: dict, context) -> dict:
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
@@ -40,45 +235,58 @@ def handler(event: dict, context) -> dict:
     if not check_auth(event):
         return resp(401, {'error': 'Unauthorized'})
 
+    result = route(event)
+    method = event.get('httpMethod', 'GET')
+    params = event.get('queryStringParameters') or {}
+    resource = params.get('resource', '')
+    groups = batch_snapshot_deps(event) if resource == 'batch' else SNAPSHOT_DEPS.get(resource)
+    if resource == 'import' and params.get('dry_run') in ('1', 'true'):
+        groups = None
+    if SNAPSHOT_STORE and method != 'GET' and result['statusCode'] in (200, 201) and groups:
+        try:
+            publish_snapshot(groups)
+        except Exception as e:
+            print(f'Snapshot publish failed: {e}')
+    return encode_response(result, negotiate_encoding(get_header(event, 'Accept-Encoding')))
+
+
+def route(event):
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters') or {}
     resource = params.get('resource', '')
     item_id = params.get('id')
 
+    # --- Import --- (тело — CSV/NDJSON, а не JSON)
+    if resource == 'import' and method == 'POST':
+        return import_products(event, params)
+
     body = {}
     if event.get('body'):
         body = json.loads(event['body'])
 
-    # --- Categories ---
-    if resource == 'categories':
-        if method == 'GET':
-            return get_categories()
-        elif method == 'POST':
-            return create_category(body)
-        elif method in ('PUT', 'PATCH') and item_id:
-            return patch_category(item_id, body) if method == 'PATCH' else update_category(item_id, body)
+    # --- Batch ---
+    if resource == 'batch' and method == 'POST':
+        return run_batch(body)
 
-    # --- Products ---
-    if resource == 'products':
-        if method == 'GET':
-            return get_products()
-        elif method == 'POST':
-            return create_product(body)
-        elif method in ('PUT', 'PATCH') and item_id:
-            return patch_product(item_id, body) if method == 'PATCH' else update_product(item_id, body)
+    # --- Bulk ---
+    if resource in BULK_FIELDS and method == 'PATCH' and not item_id:
+        return bulk_patch(resource, body)
 
-    # --- Banners ---
-    if resource == 'banners':
+    # --- CRUD ---
+    res = RESOURCES.get(resource)
+    if res:
         if method == 'GET':
-            return get_banners()
+            if resource in ADMIN_LISTS and is_list_request(params):
+                return list_resource(resource, params)
+            return list_items(res)
         elif method == 'POST':
-            return create_banner(body)
+            return create_item(res, body)
         elif method == 'PUT' and item_id:
-            return update_banner(item_id, body)
+            return update_item(res, item_id, body)
         elif method == 'PATCH' and item_id:
-            return patch_banner(item_id, body)
-        elif method == 'DELETE' and item_id:
-            return delete_banner(item_id)
+            return patch_item(res, item_id, body)
+        elif method == 'DELETE' and item_id and res.deletable:
+            return delete_item(res, item_id)
 
     # --- Settings ---
     if resource == 'settings':
@@ -87,531 +295,1444 @@ def handler(event: dict, context) -> dict:
         elif method == 'POST':
             return save_settings(body)
 
-    # --- Promotions ---
-    if resource == 'promotions':
-        if method == 'GET':
-            return get_promotions()
-        elif method == 'POST':
-            return create_promotion(body)
-        elif method == 'PUT' and item_id:
-            return update_promotion(item_id, body)
-        elif method == 'PATCH' and item_id:
-            return patch_promotion(item_id, body)
-        elif method == 'DELETE' and item_id:
-            return delete_promotion(item_id)
-
-    # --- Articles ---
-    if resource == 'articles':
+    # --- Snapshots ---
+    if resource == 'snapshot':
         if method == 'GET':
-            return get_articles()
+            return resp(200, {'manifest': get_store().read_manifest()})
         elif method == 'POST':
-            return create_article(body)
-        elif method == 'PUT' and item_id:
-            return update_article(item_id, body)
-        elif method == 'PATCH' and item_id:
-            return patch_article(item_id, body)
-        elif method == 'DELETE' and item_id:
-            return delete_article(item_id)
+            return resp(200, {'manifest': publish_snapshot()})
 
-    return resp(404, {'error': 'Not found'})
+    # --- Feeds ---
+    if resource == 'feed' and method == 'POST':
+        fmt = params.get('format', 'yml')
+        if fmt not in FEED_FORMATS:
+            return resp(400, {'error': f"format: допустимые значения {', '.join(FEED_FORMATS)}"})
+        return resp(200, export_feed(fmt, incremental=params.get('incremental') in ('1', 'true')))
 
+    # --- Maintenance ---
+    if resource == 'reconcile-counts' and method == 'POST':
+        return reconcile_counts()
 
-# ---- Categories ----
+    # --- Stats ---
+    if resource == 'stats' and method == 'GET':
+        return resp(200, {'pool': POOL.snapshot()})
 
-def get_categories():
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT c.*, COUNT(p.id) AS product_count
-                FROM categories c
-                LEFT JOIN products p ON p.category_slug = c.slug AND p.is_active = TRUE
-                GROUP BY c.id
-                ORDER BY c.sort_order, c.id
-            """)
-            rows = cur.fetchall()
-    return resp(200, {'categories': [dict(r) for r in rows]})
+    return resp(404, {'error': 'Not found'})
 
 
-def create_category(body):
-    slug = body.get('slug', '').strip()
-    name = body.get('name', '').strip()
-    if not slug or not name:
-        return resp(400, {'error': 'slug и name обязательны'})
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO categories (slug, name, icon, image_url, sort_order, is_active)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING *
-            """, (
-                slug, name,
-                body.get('icon', 'Package'),
-                body.get('image_url'),
-                body.get('sort_order', 0),
-                body.get('is_active', True),
-            ))
-            row = dict(cur.fetchone())
-        conn.commit()
-    return resp(201, {'category': row})
+# ---- Resources ----
+
+# PREPARE/EXECUTE не переживают пулер в режиме transaction (pgbouncer) — там DB_PREPARE=0.
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') not in ('0', 'false')
+_prepared = weakref.WeakKeyDictionary()
+
+
+class Statement:
+    """
+    SQL, сгенерированный один раз при импорте. На каждом соединении пула выполняется
+    PREPARE при первом использовании, дальше только EXECUTE без разбора и планирования.
+    """
+
+    def __init__(self, name, types, sql):
+        self.name = name
+        args = f" ({', '.join(types)})" if types else ''
+        self.prepare_sql = f"PREPARE {name}{args} AS {sql}"
+        self.execute_sql = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * len(types))})" if types else '')
+        self.plain_sql = re.sub(r'\$\d+', '%s', sql)
+
+    def execute(self, cur, params=()):
+        if not DB_PREPARE:
+            cur.execute(self.plain_sql, params)
+            return
+        prepared = _prepared.setdefault(cur.connection, set())
+        if self.name not in prepared:
+            cur.execute(self.prepare_sql)
+            prepared.add(self.name)
+        cur.execute(self.execute_sql, params)
+
+
+def placeholders(start, count):
+    return ', '.join(f'${n}' for n in range(start, start + count))
+
+
+class Resource:
+    """
+    Таблица админки: колонки (имя, SQL-тип, значение по умолчанию), обязательные поля и сгенерированный CRUD.
+    Ответы перечисляют колонки явно (id, редактируемые, readonly), а не SELECT *: подготовленный
+    на соединении statement не ломается («cached plan must not change result type»),
+    когда миграция добавляет в таблицу колонку.
+    """
+
+    def __init__(self, table, item, not_found, columns, required=(), order='sort_order, id',
+                 readonly=('created_at', 'updated_at'), list_sql=None, list_alias=None,
+                 touch_updated_at=False, deletable=True, normalize=None, keep=()):
+        self.table = table
+        self.item = item
+        self.not_found = not_found
+        self.columns = columns
+        self.required = required
+        self.deletable = deletable
+        self.normalize = normalize
+        # Колонки, которые PUT без этого поля оставляет как есть (формы админки их не присылают).
+        self.keep = keep
+        self.json_columns = {c[0] for c in columns if c[1] == 'jsonb'}
+
+        names = [c[0] for c in columns]
+        types = [c[1] for c in columns]
+        touch = ', updated_at = NOW()' if touch_updated_at else ''
+        n = len(columns)
+        self.output = ['id'] + names + list(readonly)
+        returning = ', '.join(self.output)
+        listed = ', '.join(f'{list_alias}.{c}' for c in self.output) if list_alias else returning
+        list_sql = list_sql or f"SELECT {{columns}} FROM {table} ORDER BY {order}"
+        self.select = Statement(f'admin_{table}_list', [], list_sql.format(columns=listed))
+        self.insert = Statement(
+            f'admin_{table}_insert', types,
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES ({placeholders(1, n)}) RETURNING {returning}",
+        )
+        self.update = Statement(
+            f'admin_{table}_update', types + ['integer'],
+            f"UPDATE {table} SET {', '.join(f'{c} = ${i}' for i, c in enumerate(names, 1))}{touch} "
+            f"WHERE id = ${n + 1} RETURNING {returning}",
+        )
+        # PATCH — один statement на все сочетания полей: пара ($флаг, $значение) на колонку.
+        self.patch = Statement(
+            f'admin_{table}_patch', [x for t in types for x in ('boolean', t)] + ['integer'],
+            f"UPDATE {table} SET "
+            + ', '.join(f'{c} = CASE WHEN ${2 * i - 1} THEN ${2 * i} ELSE {c} END' for i, c in enumerate(names, 1))
+            + f"{touch} WHERE id = ${2 * n + 1} RETURNING {returning}",
+        )
+        self.delete = Statement(f'admin_{table}_delete', ['integer'], f"DELETE FROM {table} WHERE id = $1 RETURNING id")
+
+    def full_values(self, body):
+        values = {name: body.get(name, default) for name, _, default in self.columns}
+        for k in self.required:
+            values[k] = (body.get(k) or '').strip()
+        missing = [k for k in self.required if not values[k]]
+        if missing:
+            raise ValueError(f"{' и '.join(self.required)} {'обязательны' if len(self.required) > 1 else 'обязателен'}")
+        return self.prepare(values)
+
+    def patch_values(self, body):
+        values = {name: body[name] for name, _, _ in self.columns if name in body}
+        if not values:
+            raise ValueError('Нет полей для обновления')
+        return self.prepare(values)
+
+    def prepare(self, values):
+        if self.normalize:
+            values = self.normalize(values)
+        for name in self.json_columns & set(values):
+            if values[name] is not None and not isinstance(values[name], str):
+                values[name] = json.dumps(values[name], ensure_ascii=False)
+        return values
+
+
+def normalize_product(values):
+    if 'specifications' in values:
+        specs = values['specifications']
+        if isinstance(specs, str):
+            try:
+                specs = json.loads(specs)
+            except ValueError:
+                specs = {}
+        values['specifications'] = specs if specs is not None else {}
+    if 'sku' in values:
+        values['sku'] = values['sku'] or None
+    return values
+
+
+RESOURCES = {
+    'categories': Resource(
+        'categories', 'category', 'Категория не найдена',
+        [
+            ('slug', 'text', ''), ('name', 'text', ''), ('icon', 'text', 'Package'), ('image_url', 'text', None),
+            ('sort_order', 'integer', 0), ('is_active', 'boolean', True), ('image_variants', 'jsonb', None),
+        ],
+        required=('slug', 'name'),
+        readonly=('product_count', 'created_at', 'updated_at'),
+        deletable=False,
+        keep=('image_variants',),
+    ),
+    'products': Resource(
+        'products', 'product', 'Товар не найден',
+        [
+            ('name', 'text', ''), ('category_slug', 'text', None), ('price', 'numeric', 0),
+            ('description', 'text', None), ('image_url', 'text', None), ('in_stock', 'boolean', True),
+            ('sort_order', 'integer', 0), ('is_active', 'boolean', True), ('sku', 'text', None),
+            ('specifications', 'jsonb', {}), ('image_variants', 'jsonb', None),
+        ],
+        required=('name',),
+        list_sql="""
+            SELECT {columns}, c.name AS category_name
+            FROM products p
+            LEFT JOIN categories c ON c.slug = p.category_slug
+            ORDER BY p.category_slug, p.sort_order, p.id
+        """,
+        list_alias='p',
+        touch_updated_at=True,
+        deletable=False,
+        normalize=normalize_product,
+        keep=('image_variants',),
+    ),
+    'banners': Resource(
+        'banners', 'banner', 'Баннер не найден',
+        [
+            ('title', 'text', ''), ('description', 'text', None), ('image_url', 'text', None),
+            ('badge', 'text', 'Новость'), ('button_text', 'text', 'Подробнее'), ('button_url', 'text', '/catalog'),
+            ('gradient', 'text', 'from-secondary/95 to-muted/90'), ('is_active', 'boolean', True),
+            ('sort_order', 'integer', 0), ('image_variants', 'jsonb', None),
+        ],
+        required=('title',),
+        keep=('image_variants',),
+    ),
+    'articles': Resource(
+        'articles', 'article', 'Статья не найдена',
+        [
+            ('slug', 'text', ''), ('title', 'text', ''), ('excerpt', 'text', None), ('content', 'text', None),
+            ('image_url', 'text', None), ('category', 'text', 'Статья'), ('read_time', 'text', '5 мин'),
+            ('is_published', 'boolean', True), ('sort_order', 'integer', 0),
+        ],
+        required=('title', 'slug'),
+        order='sort_order, created_at DESC',
+        touch_updated_at=True,
+    ),
+    'promotions': Resource(
+        'promotions', 'promotion', 'Акция не найдена',
+        [
+            ('title', 'text', ''), ('description', 'text', None), ('badge', 'text', 'СКИДКА'),
+            ('badge_value', 'text', ''), ('button_text', 'text', 'Смотреть товары'),
+            ('button_url', 'text', '/catalog'), ('expires_at', 'text', ''), ('is_active', 'boolean', True),
+            ('sort_order', 'integer', 0),
+        ],
+        required=('title',),
+    ),
+}
 
 
-def update_category(cat_id, body):
-    slug = body.get('slug', '').strip()
-    name = body.get('name', '').strip()
-    if not slug or not name:
-        return resp(400, {'error': 'slug и name обязательны'})
+def run_statement(stmt, params=()):
     with get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE categories
-                SET slug=%s, name=%s, icon=%s, image_url=%s, sort_order=%s, is_active=%s
-                WHERE id=%s RETURNING *
-            """, (
-                slug, name,
-                body.get('icon', 'Package'),
-                body.get('image_url'),
-                body.get('sort_order', 0),
-                body.get('is_active', True),
-                cat_id,
-            ))
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Категория не найдена'})
-    return resp(200, {'category': dict(row)})
-
-
-def patch_category(cat_id, body):
-    fields, values = [], []
-    for k in ['name', 'slug', 'icon', 'image_url', 'sort_order', 'is_active']:
-        if k in body:
-            fields.append(f"{k} = %s")
-            values.append(body[k])
-    if not fields:
-        return resp(400, {'error': 'Нет полей для обновления'})
-    values.append(cat_id)
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"UPDATE categories SET {', '.join(fields)} WHERE id=%s RETURNING *", values)
-            row = cur.fetchone()
+            stmt.execute(cur, params)
+            rows = cur.fetchall()
         conn.commit()
-    if not row:
-        return resp(404, {'error': 'Категория не найдена'})
-    return resp(200, {'category': dict(row)})
+    return rows
+
+
+def list_items(res):
+    rows = run_statement(res.select)
+    return resp(200, {res.table: [dict(r) for r in rows]})
+
+
+def create_item(res, body):
+    try:
+        values = res.full_values(body)
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+    rows = run_statement(res.insert, list(values.values()))
+    return resp(201, {res.item: dict(rows[0])})
+
+
+def update_item(res, item_id, body):
+    try:
+        values = res.full_values(body)
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+    absent = {k for k in res.keep if k not in body}
+    if absent:
+        params = []
+        for name, _, _ in res.columns:
+            params += [name not in absent, values[name]]
+        rows = run_statement(res.patch, params + [item_id])
+    else:
+        rows = run_statement(res.update, list(values.values()) + [item_id])
+    if not rows:
+        return resp(404, {'error': res.not_found})
+    return resp(200, {res.item: dict(rows[0])})
+
+
+def patch_item(res, item_id, body):
+    try:
+        values = res.patch_values(body)
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+    params = []
+    for name, _, _ in res.columns:
+        params += [name in values, values.get(name)]
+    rows = run_statement(res.patch, params + [item_id])
+    if not rows:
+        return resp(404, {'error': res.not_found})
+    return resp(200, {res.item: dict(rows[0])})
+
+
+def delete_item(res, item_id):
+    rows = run_statement(res.delete, (item_id,))
+    if not rows:
+        return resp(404, {'error': res.not_found})
+    return resp(200, {'deleted': item_id})
 
 
-# ---- Products ----
+# ---- Categories ----
 
-def get_products():
+def reconcile_counts():
     with get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT p.*, c.name AS category_name
-                FROM products p
-                LEFT JOIN categories c ON c.slug = p.category_slug
-                ORDER BY p.category_slug, p.sort_order, p.id
-            """)
+            cur.execute("SELECT * FROM reconcile_category_product_counts()")
             rows = cur.fetchall()
-    return resp(200, {'products': [dict(r) for r in rows]})
+        conn.commit()
+    return resp(200, {'repaired': [dict(r) for r in rows]})
 
 
-def create_product(body):
-    name = body.get('name', '').strip()
-    if not name:
-        return resp(400, {'error': 'name обязателен'})
-    import json as _json
-    specs = body.get('specifications', {})
-    if isinstance(specs, str):
-        try:
-            specs = _json.loads(specs)
-        except Exception:
-            specs = {}
+# ---- Settings ----
+
+def get_settings():
     with get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO products (name, category_slug, price, description, image_url, in_stock, sort_order, is_active, sku, specifications)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING *
-            """, (
-                name,
-                body.get('category_slug'),
-                body.get('price', 0),
-                body.get('description'),
-                body.get('image_url'),
-                body.get('in_stock', True),
-                body.get('sort_order', 0),
-                body.get('is_active', True),
-                body.get('sku') or None,
-                _json.dumps(specs, ensure_ascii=False),
-            ))
-            row = dict(cur.fetchone())
-        conn.commit()
-    return resp(201, {'product': row})
+            cur.execute("SELECT key, value, label FROM settings ORDER BY key")
+            rows = cur.fetchall()
+    return resp(200, {'settings': {r['key']: {'value': r['value'], 'label': r['label']} for r in rows}})
 
 
-def update_product(prod_id, body):
-    name = body.get('name', '').strip()
-    if not name:
-        return resp(400, {'error': 'name обязателен'})
-    import json as _json
-    specs = body.get('specifications', {})
-    if isinstance(specs, str):
-        try:
-            specs = _json.loads(specs)
-        except Exception:
-            specs = {}
+def save_settings(body):
+    updates = body.get('settings', {})
+    if not updates:
+        return resp(400, {'error': 'Нет данных'})
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE products
-                SET name=%s, category_slug=%s, price=%s, description=%s,
-                    image_url=%s, in_stock=%s, sort_order=%s, is_active=%s,
-                    sku=%s, specifications=%s, updated_at=NOW()
-                WHERE id=%s RETURNING *
-            """, (
-                name,
-                body.get('category_slug'),
-                body.get('price', 0),
-                body.get('description'),
-                body.get('image_url'),
-                body.get('in_stock', True),
-                body.get('sort_order', 0),
-                body.get('is_active', True),
-                body.get('sku') or None,
-                _json.dumps(specs, ensure_ascii=False),
-                prod_id,
-            ))
-            row = cur.fetchone()
+        with conn.cursor() as cur:
+            for key, value in updates.items():
+                cur.execute("""
+                    INSERT INTO settings (key, value, updated_at)
+                    VALUES (%s, %s, NOW())
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+                """, (key, str(value)))
         conn.commit()
-    if not row:
-        return resp(404, {'error': 'Товар не найден'})
-    return resp(200, {'product': dict(row)})
+    return resp(200, {'saved': True})
+
+
+# ---- Admin listings ----
+
+ADMIN_LIST_DEFAULT_LIMIT = 50
+ADMIN_LIST_MAX_LIMIT = 200
+# Любой из этих параметров переключает GET со «всей таблицы» на постраничную выдачу.
+ADMIN_LIST_PARAMS = ('limit', 'cursor', 'fields', 'q', 'sort', 'status', 'category', 'in_stock', 'total')
+ADMIN_LIST_TOTALS = ('exact', 'estimate', 'none')
+
+# Колонки, фильтры и сортировки списков админки. Ключ сортировки всегда заканчивается id,
+# nullable-колонки обёрнуты в COALESCE, чтобы keyset-сравнение строк было корректным.
+ADMIN_LISTS = {
+    'products': {
+        'table': 'products',
+        'from': 'products p LEFT JOIN categories c ON c.slug = p.category_slug',
+        'fields': {
+            'id': 'p.id', 'name': 'p.name', 'sku': 'p.sku', 'category_slug': 'p.category_slug',
+            'category_name': 'c.name', 'price': 'p.price', 'image_url': 'p.image_url',
+            'in_stock': 'p.in_stock', 'is_active': 'p.is_active', 'sort_order': 'p.sort_order',
+            'description': 'p.description', 'specifications': 'p.specifications',
+            'image_variants': 'p.image_variants', 'created_at': 'p.created_at', 'updated_at': 'p.updated_at',
+        },
+        'default_fields': ('id', 'name', 'sku', 'category_slug', 'category_name', 'price', 'image_url',
+                           'in_stock', 'is_active', 'sort_order', 'updated_at'),
+        'search': ('p.name', 'p.sku'),
+        'status': ('p.is_active', {'active': True, 'inactive': False}),
+        'category': 'p.category_slug',
+        'in_stock': 'p.in_stock',
+        'sorts': {
+            'position': ("COALESCE(p.category_slug, '')", 'p.sort_order', 'p.id'),
+            'name': ('p.name', 'p.id'),
+            'price': ('p.price', 'p.id'),
+            'updated': ("COALESCE(p.updated_at, 'epoch')", 'p.id'),
+            'id': ('p.id',),
+        },
+    },
+    'articles': {
+        'table': 'articles',
+        'from': 'articles a',
+        'fields': {
+            'id': 'a.id', 'slug': 'a.slug', 'title': 'a.title', 'excerpt': 'a.excerpt', 'content': 'a.content',
+            'image_url': 'a.image_url', 'category': 'a.category', 'read_time': 'a.read_time',
+            'is_published': 'a.is_published', 'sort_order': 'a.sort_order',
+            'created_at': 'a.created_at', 'updated_at': 'a.updated_at',
+        },
+        'default_fields': ('id', 'slug', 'title', 'excerpt', 'image_url', 'category', 'read_time',
+                           'is_published', 'sort_order', 'created_at', 'updated_at'),
+        'search': ('a.title', 'a.slug'),
+        'status': ('a.is_published', {'published': True, 'draft': False}),
+        'category': 'a.category',
+        'sorts': {
+            'position': ('COALESCE(a.sort_order, 0)', 'a.id'),
+            'title': ('a.title', 'a.id'),
+            'created': ("COALESCE(a.created_at, 'epoch')", 'a.id'),
+            'updated': ("COALESCE(a.updated_at, 'epoch')", 'a.id'),
+            'id': ('a.id',),
+        },
+    },
+    'banners': {
+        'table': 'banners',
+        'from': 'banners b',
+        'fields': {
+            'id': 'b.id', 'title': 'b.title', 'description': 'b.description', 'image_url': 'b.image_url',
+            'badge': 'b.badge', 'button_text': 'b.button_text', 'button_url': 'b.button_url',
+            'gradient': 'b.gradient', 'is_active': 'b.is_active', 'sort_order': 'b.sort_order',
+            'image_variants': 'b.image_variants', 'created_at': 'b.created_at',
+        },
+        'search': ('b.title',),
+        'status': ('b.is_active', {'active': True, 'inactive': False}),
+        'sorts': {
+            'position': ('COALESCE(b.sort_order, 0)', 'b.id'),
+            'title': ('b.title', 'b.id'),
+            'created': ("COALESCE(b.created_at, 'epoch')", 'b.id'),
+            'id': ('b.id',),
+        },
+    },
+    'promotions': {
+        'table': 'promotions',
+        'from': 'promotions pr',
+        'fields': {
+            'id': 'pr.id', 'title': 'pr.title', 'description': 'pr.description', 'badge': 'pr.badge',
+            'badge_value': 'pr.badge_value', 'button_text': 'pr.button_text', 'button_url': 'pr.button_url',
+            'expires_at': 'pr.expires_at', 'is_active': 'pr.is_active', 'sort_order': 'pr.sort_order',
+            'created_at': 'pr.created_at',
+        },
+        'search': ('pr.title',),
+        'status': ('pr.is_active', {'active': True, 'inactive': False}),
+        'sorts': {
+            'position': ('COALESCE(pr.sort_order, 0)', 'pr.id'),
+            'title': ('pr.title', 'pr.id'),
+            'created': ("COALESCE(pr.created_at, 'epoch')", 'pr.id'),
+            'id': ('pr.id',),
+        },
+    },
+}
 
 
-# ---- Banners ----
+def is_list_request(params):
+    return any(params.get(k) for k in ADMIN_LIST_PARAMS)
+
+
+def parse_list_limit(raw):
+    if not raw:
+        return ADMIN_LIST_DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise ValueError('limit должен быть числом')
+    if limit < 1:
+        raise ValueError('limit должен быть больше 0')
+    return min(limit, ADMIN_LIST_MAX_LIMIT)
+
+
+def parse_list_fields(spec, raw):
+    if not raw:
+        return spec.get('default_fields') or tuple(spec['fields'])
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in spec['fields']]
+    if unknown:
+        raise ValueError(f"fields: неизвестные поля {', '.join(unknown)}")
+    return tuple(dict.fromkeys(['id'] + fields))
+
+
+def parse_list_sort(spec, raw):
+    name = (raw or 'position').strip()
+    desc = name.startswith('-')
+    name = name.lstrip('-')
+    if name not in spec['sorts']:
+        raise ValueError(f"sort: допустимые значения {', '.join(spec['sorts'])}")
+    return spec['sorts'][name], desc
+
+
+def encode_list_cursor(keys):
+    raw = json.dumps(keys, ensure_ascii=False, default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_list_cursor(cursor, size):
+    if not cursor:
+        return None
+    try:
+        keys = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(keys, list) or len(keys) != size:
+            raise TypeError
+        return keys
+    except (ValueError, TypeError):
+        raise ValueError('Некорректный cursor')
+
+
+def list_filters(spec, params):
+    conditions, values = [], []
+    q = (params.get('q') or '').strip()
+    if q:
+        pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append('(' + ' OR '.join(f'{col} ILIKE %s' for col in spec['search']) + ')')
+        values.extend([pattern] * len(spec['search']))
+    status = params.get('status')
+    if status:
+        col, choices = spec['status']
+        if status not in choices:
+            raise ValueError(f"status: допустимые значения {', '.join(choices)}")
+        conditions.append(f'{col} = %s')
+        values.append(choices[status])
+    if params.get('category'):
+        if 'category' not in spec:
+            raise ValueError('Фильтр category не поддерживается')
+        conditions.append(f"{spec['category']} = %s")
+        values.append(params['category'])
+    if params.get('in_stock'):
+        if 'in_stock' not in spec:
+            raise ValueError('Фильтр in_stock не поддерживается')
+        if params['in_stock'] not in ('0', '1', 'true', 'false'):
+            raise ValueError('in_stock должен быть 0 или 1')
+        conditions.append(f"{spec['in_stock']} = %s")
+        values.append(params['in_stock'] in ('1', 'true'))
+    return conditions, values
+
+
+def count_list(cur, spec, conditions, values, mode):
+    """Точный COUNT(*) или оценка из статистики планировщика (только без фильтров)."""
+    if mode == 'estimate' and not conditions:
+        cur.execute("SELECT reltuples::bigint AS n FROM pg_class WHERE oid = %s::regclass", (spec['table'],))
+        row = cur.fetchone()
+        if row and row['n'] >= 0:
+            return row['n'], True
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cur.execute(f"SELECT COUNT(*) AS n FROM {spec['from']} {where}", values)
+    return cur.fetchone()['n'], False
+
+
+def list_resource(resource, params):
+    """
+    Постраничный список для админки: keyset по ключу сортировки, проекция колонок,
+    поиск (ILIKE по триграммным индексам), фильтры статуса/категории и общее количество.
+    """
+    spec = ADMIN_LISTS[resource]
+    try:
+        limit = parse_list_limit(params.get('limit'))
+        fields = parse_list_fields(spec, params.get('fields'))
+        keys, desc = parse_list_sort(spec, params.get('sort'))
+        after = decode_list_cursor(params.get('cursor'), len(keys))
+        conditions, values = list_filters(spec, params)
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+    total_mode = params.get('total') or ('none' if after else 'estimate')
+    if total_mode not in ADMIN_LIST_TOTALS:
+        return resp(400, {'error': f"total: допустимые значения {', '.join(ADMIN_LIST_TOTALS)}"})
+
+    page_conditions, page_values = list(conditions), list(values)
+    if after is not None:
+        page_conditions.append(f"({', '.join(keys)}) {'<' if desc else '>'} ({', '.join(['%s'] * len(keys))})")
+        page_values.extend(after)
+    columns = [f"{spec['fields'][f]} AS {f}" for f in fields]
+    columns += [f'{k} AS _k{n}' for n, k in enumerate(keys)]
+    where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+    order = ', '.join(f"{k} {'DESC' if desc else 'ASC'}" for k in keys)
 
-def get_banners():
     with get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM banners ORDER BY sort_order, id")
-            rows = cur.fetchall()
-    return resp(200, {'banners': [dict(r) for r in rows]})
-
+            cur.execute(f"""
+                SELECT {', '.join(columns)}
+                FROM {spec['from']}
+                {where}
+                ORDER BY {order}
+                LIMIT %s
+            """, page_values + [limit + 1])
+            rows = [dict(r) for r in cur.fetchall()]
+            total, estimated = None, False
+            if total_mode != 'none':
+                total, estimated = count_list(cur, spec, conditions, values, total_mode)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    last_keys = [rows[-1][f'_k{n}'] for n in range(len(keys))] if rows else None
+    for row in rows:
+        for n in range(len(keys)):
+            row.pop(f'_k{n}')
+    return resp(200, {
+        resource: rows,
+        'next_cursor': encode_list_cursor(last_keys) if has_more else None,
+        'total': total,
+        'total_estimated': estimated,
+    })
+
+
+# ---- Bulk ----
+
+BULK_MAX_ITEMS = 1000
+
+# Поля, которые можно менять пачкой, и их SQL-типы для VALUES.
+BULK_FIELDS = {
+    'categories': {'sort_order': 'integer', 'is_active': 'boolean'},
+    'products': {'sort_order': 'integer', 'is_active': 'boolean', 'in_stock': 'boolean'},
+    'banners': {'sort_order': 'integer', 'is_active': 'boolean'},
+    'promotions': {'sort_order': 'integer', 'is_active': 'boolean'},
+    'articles': {'sort_order': 'integer', 'is_published': 'boolean'},
+}
+BULK_TOUCHES_UPDATED_AT = {'products', 'articles'}
+
+
+def bulk_patch(resource, body):
+    """
+    Пачка изменений sort_order / is_active вида {"items": [{"id": 1, "sort_order": 0}, ...]}
+    одним UPDATE ... FROM (VALUES ...) в одной транзакции. Не переданное поле не меняется.
+    """
+    fields = BULK_FIELDS[resource]
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        return resp(400, {'error': 'items обязателен'})
+    if len(items) > BULK_MAX_ITEMS:
+        return resp(400, {'error': f'Не больше {BULK_MAX_ITEMS} элементов за запрос'})
+
+    rows = []
+    for n, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('id'), int) or isinstance(item.get('id'), bool):
+            return resp(400, {'error': f'items[{n}]: id обязателен'})
+        unknown = set(item) - set(fields) - {'id'}
+        if unknown:
+            return resp(400, {'error': f"items[{n}]: нельзя менять {', '.join(sorted(unknown))}"})
+        for k, sql_type in fields.items():
+            v = item.get(k)
+            if v is None:
+                continue
+            if sql_type == 'boolean' and not isinstance(v, bool):
+                return resp(400, {'error': f'items[{n}].{k} должен быть true/false'})
+            if sql_type == 'integer' and (not isinstance(v, int) or isinstance(v, bool)):
+                return resp(400, {'error': f'items[{n}].{k} должен быть целым числом'})
+        rows.append([item['id']] + [item.get(k) for k in fields])
+
+    names = list(fields)
+    assignments = [f"{k} = COALESCE(v.{k}, t.{k})" for k in names]
+    if resource in BULK_TOUCHES_UPDATED_AT:
+        assignments.append("updated_at = NOW()")
+    template = '(' + ', '.join(['%s::integer'] + [f'%s::{fields[k]}' for k in names]) + ')'
 
-def create_banner(body):
-    title = body.get('title', '').strip()
-    if not title:
-        return resp(400, {'error': 'title обязателен'})
     with get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO banners (title, description, image_url, badge, button_text, button_url, gradient, is_active, sort_order)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
-            """, (
-                title,
-                body.get('description'),
-                body.get('image_url'),
-                body.get('badge', 'Новость'),
-                body.get('button_text', 'Подробнее'),
-                body.get('button_url', '/catalog'),
-                body.get('gradient', 'from-secondary/95 to-muted/90'),
-                body.get('is_active', True),
-                body.get('sort_order', 0),
-            ))
-            row = dict(cur.fetchone())
+            updated = execute_values(cur, f"""
+                UPDATE {resource} t SET {', '.join(assignments)}
+                FROM (VALUES %s) AS v(id, {', '.join(names)})
+                WHERE t.id = v.id
+                RETURNING {', '.join(f't.{c}' for c in RESOURCES[resource].output)}
+            """, rows, template=template, page_size=len(rows), fetch=True)
         conn.commit()
-    return resp(201, {'banner': row})
 
+    found = {r['id'] for r in updated}
+    not_found = sorted({row[0] for row in rows} - found)
+    return resp(200, {resource: [dict(r) for r in updated], 'not_found': not_found})
 
-def update_banner(ban_id, body):
-    title = body.get('title', '').strip()
-    if not title:
-        return resp(400, {'error': 'title обязателен'})
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE banners SET title=%s, description=%s, image_url=%s, badge=%s,
-                    button_text=%s, button_url=%s, gradient=%s, is_active=%s, sort_order=%s
-                WHERE id=%s RETURNING *
-            """, (
-                title,
-                body.get('description'),
-                body.get('image_url'),
-                body.get('badge', 'Новость'),
-                body.get('button_text', 'Подробнее'),
-                body.get('button_url', '/catalog'),
-                body.get('gradient', 'from-secondary/95 to-muted/90'),
-                body.get('is_active', True),
-                body.get('sort_order', 0),
-                ban_id,
-            ))
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Баннер не найден'})
-    return resp(200, {'banner': dict(row)})
-
-
-def patch_banner(ban_id, body):
-    fields, values = [], []
-    for k in ['title', 'description', 'image_url', 'badge', 'button_text', 'button_url', 'gradient', 'is_active', 'sort_order']:
-        if k in body:
-            fields.append(f"{k} = %s")
-            values.append(body[k])
-    if not fields:
-        return resp(400, {'error': 'Нет полей для обновления'})
-    values.append(ban_id)
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"UPDATE banners SET {', '.join(fields)} WHERE id=%s RETURNING *", values)
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Баннер не найден'})
-    return resp(200, {'banner': dict(row)})
 
+# ---- Batch ----
 
-def delete_banner(ban_id):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM banners WHERE id=%s RETURNING id", (ban_id,))
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Баннер не найден'})
-    return resp(200, {'deleted': ban_id})
+BATCH_MAX_OPERATIONS = 100
+BATCH_RESOURCES = ('categories', 'products', 'banners', 'promotions', 'articles', 'settings')
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
 
 
-# ---- Articles ----
+class BatchConnection:
+    """Обёртка над соединением batch-запроса: commit() операций откладывается до конца пачки."""
 
-def get_articles():
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM articles ORDER BY sort_order, created_at DESC")
-            rows = cur.fetchall()
-    return resp(200, {'articles': [dict(r) for r in rows]})
+    def __init__(self, conn):
+        self._conn = conn
 
+    def commit(self):
+        pass
 
-def create_article(body):
-    title = body.get('title', '').strip()
-    slug = body.get('slug', '').strip()
-    if not title or not slug:
-        return resp(400, {'error': 'title и slug обязательны'})
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO articles (slug, title, excerpt, content, image_url, category, read_time, is_published, sort_order)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
-            """, (
-                slug, title,
-                body.get('excerpt'),
-                body.get('content'),
-                body.get('image_url'),
-                body.get('category', 'Статья'),
-                body.get('read_time', '5 мин'),
-                body.get('is_published', True),
-                body.get('sort_order', 0),
-            ))
-            row = dict(cur.fetchone())
-        conn.commit()
-    return resp(201, {'article': row})
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
 
 
-def update_article(art_id, body):
-    title = body.get('title', '').strip()
-    slug = body.get('slug', '').strip()
-    if not title or not slug:
-        return resp(400, {'error': 'title и slug обязательны'})
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE articles SET slug=%s, title=%s, excerpt=%s, content=%s,
-                    image_url=%s, category=%s, read_time=%s, is_published=%s,
-                    sort_order=%s, updated_at=NOW()
-                WHERE id=%s RETURNING *
-            """, (
-                slug, title,
-                body.get('excerpt'),
-                body.get('content'),
-                body.get('image_url'),
-                body.get('category', 'Статья'),
-                body.get('read_time', '5 мин'),
-                body.get('is_published', True),
-                body.get('sort_order', 0),
-                art_id,
-            ))
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Статья не найдена'})
-    return resp(200, {'article': dict(row)})
-
-
-def patch_article(art_id, body):
-    fields, values = [], []
-    for k in ['slug', 'title', 'excerpt', 'content', 'image_url', 'category', 'read_time', 'is_published', 'sort_order']:
-        if k in body:
-            fields.append(f"{k} = %s")
-            values.append(body[k])
-    if not fields:
-        return resp(400, {'error': 'Нет полей для обновления'})
-    fields.append("updated_at = NOW()")
-    values.append(art_id)
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"UPDATE articles SET {', '.join(fields)} WHERE id=%s RETURNING *", values)
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Статья не найдена'})
-    return resp(200, {'article': dict(row)})
+def batch_operation_event(op):
+    params = {'resource': op['resource']}
+    if op.get('id') is not None:
+        params['id'] = str(op['id'])
+    return {
+        'httpMethod': op['method'],
+        'queryStringParameters': params,
+        'body': json.dumps(op['body'], ensure_ascii=False) if op.get('body') is not None else None,
+    }
 
 
-def delete_article(art_id):
+def run_batch(body):
+    """
+    Выполняет {"operations": [{"resource", "method", "id"?, "body"?, "returning"?}, ...]}
+    по порядку на одном соединении в одной транзакции. Первая ошибка откатывает всю пачку.
+    """
+    ops = body.get('operations')
+    if not isinstance(ops, list) or not ops:
+        return resp(400, {'error': 'operations обязателен'})
+    if len(ops) > BATCH_MAX_OPERATIONS:
+        return resp(400, {'error': f'Не больше {BATCH_MAX_OPERATIONS} операций за запрос'})
+    for n, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get('resource') not in BATCH_RESOURCES:
+            return resp(400, {'error': f"operations[{n}].resource: допустимые значения {', '.join(BATCH_RESOURCES)}"})
+        op['method'] = str(op.get('method', '')).upper()
+        if op['method'] not in BATCH_METHODS:
+            return resp(400, {'error': f"operations[{n}].method: допустимые значения {', '.join(BATCH_METHODS)}"})
+
+    results = []
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM articles WHERE id=%s RETURNING id", (art_id,))
-            row = cur.fetchone()
+        _batch.conn = BatchConnection(conn)
+        try:
+            for n, op in enumerate(ops):
+                try:
+                    result = route(batch_operation_event(op))
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    return resp(409, {'error': f'operations[{n}]: {e.pgerror or e}'.strip(), 'failed': n})
+                data = json.loads(result['body'])
+                if result['statusCode'] >= 400:
+                    conn.rollback()
+                    return resp(result['statusCode'], {**data, 'failed': n})
+                results.append({'status': result['statusCode'], **data} if op.get('returning', True)
+                               else {'status': result['statusCode']})
+        finally:
+            _batch.conn = None
         conn.commit()
-    if not row:
-        return resp(404, {'error': 'Статья не найдена'})
-    return resp(200, {'deleted': art_id})
+    return resp(200, {'results': results})
+
+
+def batch_snapshot_deps(event):
+    try:
+        ops = json.loads(event.get('body') or '{}').get('operations') or []
+    except ValueError:
+        return None
+    groups = set()
+    for op in ops:
+        if isinstance(op, dict) and str(op.get('method', '')).upper() != 'GET':
+            groups.update(SNAPSHOT_DEPS.get(op.get('resource'), ()))
+    return tuple(sorted(groups))
+
+
+# ---- Snapshots ----
+
+# s3 — бакет проекта (как в upload-image), local:/path — каталог на диске. Пусто — без автопубликации.
+SNAPSHOT_STORE = os.environ.get('SNAPSHOT_STORE', '')
+# Те же переменные, что у upload-image: бакет можно подменить локальным S3-совместимым стендом.
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', '')
+SNAPSHOT_PREFIX = 'catalog/snapshots'
+
+# Какие шарды пересобирать после изменения ресурса.
+SNAPSHOT_DEPS = {
+    'categories': ('categories', 'products'),
+    'products': ('categories', 'products'),
+    'articles': ('articles',),
+    'banners': ('banners',),
+    'promotions': ('promotions',),
+    'settings': ('settings',),
+    'reconcile-counts': ('categories',),
+    'import': ('categories', 'products'),
+}
 
 
-# ---- Promotions ----
+class SnapshotStore:
+    def read_manifest(self):
+        data = self.get(f'{SNAPSHOT_PREFIX}/manifest.json')
+        return json.loads(data) if data else None
 
-def get_promotions():
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM promotions ORDER BY sort_order, id")
-            rows = cur.fetchall()
-    return resp(200, {'promotions': [dict(r) for r in rows]})
 
+class S3Store(SnapshotStore):
+    def __init__(self):
+        import boto3
+        self.bucket = S3_BUCKET
+        self.client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        )
 
-def create_promotion(body):
-    title = body.get('title', '').strip()
-    if not title:
-        return resp(400, {'error': 'title обязателен'})
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO promotions (title, description, badge, badge_value, button_text, button_url, expires_at, is_active, sort_order)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
-            """, (
-                title,
-                body.get('description'),
-                body.get('badge', 'СКИДКА'),
-                body.get('badge_value', ''),
-                body.get('button_text', 'Смотреть товары'),
-                body.get('button_url', '/catalog'),
-                body.get('expires_at', ''),
-                body.get('is_active', True),
-                body.get('sort_order', 0),
-            ))
-            row = dict(cur.fetchone())
-        conn.commit()
-    return resp(201, {'promotion': row})
+    def url(self, key):
+        if PUBLIC_BASE_URL:
+            return f"{PUBLIC_BASE_URL.rstrip('/')}/{key}"
+        return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
 
+    def put(self, key, data, cache_control, content_type='application/json; charset=utf-8'):
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=data,
+            ContentType=content_type, CacheControl=cache_control,
+        )
 
-def update_promotion(promo_id, body):
-    title = body.get('title', '').strip()
-    if not title:
-        return resp(400, {'error': 'title обязателен'})
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE promotions SET title=%s, description=%s, badge=%s, badge_value=%s,
-                    button_text=%s, button_url=%s, expires_at=%s, is_active=%s, sort_order=%s
-                WHERE id=%s RETURNING *
-            """, (
-                title,
-                body.get('description'),
-                body.get('badge', 'СКИДКА'),
-                body.get('badge_value', ''),
-                body.get('button_text', 'Смотреть товары'),
-                body.get('button_url', '/catalog'),
-                body.get('expires_at', ''),
-                body.get('is_active', True),
-                body.get('sort_order', 0),
-                promo_id,
-            ))
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Акция не найдена'})
-    return resp(200, {'promotion': dict(row)})
-
-
-def patch_promotion(promo_id, body):
-    fields, values = [], []
-    for k in ['title', 'description', 'badge', 'badge_value', 'button_text', 'button_url', 'expires_at', 'is_active', 'sort_order']:
-        if k in body:
-            fields.append(f"{k} = %s")
-            values.append(body[k])
-    if not fields:
-        return resp(400, {'error': 'Нет полей для обновления'})
-    values.append(promo_id)
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"UPDATE promotions SET {', '.join(fields)} WHERE id=%s RETURNING *", values)
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Акция не найдена'})
-    return resp(200, {'promotion': dict(row)})
+    def open_writer(self, key, content_type):
+        return S3StreamWriter(self.client, self.bucket, key, content_type)
 
+    def open_reader(self, key):
+        body = self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+        return codecs.getreader('utf-8')(body)
 
-def delete_promotion(promo_id):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM promotions WHERE id=%s RETURNING id", (promo_id,))
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Акция не найдена'})
-    return resp(200, {'deleted': promo_id})
-
-def patch_product(prod_id, body):
-    fields, values = [], []
-    for k in ['name', 'category_slug', 'price', 'description', 'image_url', 'in_stock', 'sort_order', 'is_active', 'sku', 'specifications']:
-        if k in body:
-            fields.append(f"{k} = %s")
-            values.append(body[k])
-    if not fields:
-        return resp(400, {'error': 'Нет полей для обновления'})
-    fields.append("updated_at = NOW()")
-    values.append(prod_id)
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"UPDATE products SET {', '.join(fields)} WHERE id=%s RETURNING *", values)
-            row = cur.fetchone()
-        conn.commit()
-    if not row:
-        return resp(404, {'error': 'Товар не найден'})
-    return resp(200, {'product': dict(row)})
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
 
 
-# ---- Settings ----
+class LocalStore(SnapshotStore):
+    def __init__(self, root):
+        self.root = root
 
-def get_settings():
+    def url(self, key):
+        return f'file://{os.path.join(self.root, key)}'
+
+    def put(self, key, data, cache_control, content_type=None):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.root, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open_writer(self, key, content_type):
+        return LocalStreamWriter(os.path.join(self.root, key))
+
+    def open_reader(self, key):
+        return open(os.path.join(self.root, key), encoding='utf-8', newline='')
+
+
+def get_store():
+    if SNAPSHOT_STORE.startswith('local:'):
+        return LocalStore(SNAPSHOT_STORE[len('local:'):])
+    return S3Store()
+
+
+def dirty_product_slugs(cur, watermark):
+    """
+    Категории, шарды товаров которых могли измениться после снимка с водяным знаком watermark.
+    Перенос, удаление и скрытие товара меняют product_count (V0012/V0019), а значит и
+    change_xid строк категорий — поэтому старая категория товара тоже попадает в выборку.
+    """
+    cur.execute("""
+        SELECT category_slug AS slug FROM products WHERE change_xid >= %s::xid8
+        UNION
+        SELECT slug FROM categories WHERE change_xid >= %s::xid8
+    """, (watermark, watermark))
+    return [r['slug'] for r in cur.fetchall() if r['slug']]
+
+
+def render_shards(cur, groups, product_slugs=None):
+    """
+    Шарды в том же формате, что и ответы catalog-public: имя шарда -> данные.
+    product_slugs ограничивает пересборку товаров этими категориями (None — все).
+    """
+    shards = {}
+    if 'categories' in groups:
+        cur.execute("""
+            SELECT id, slug, name, icon, image_url, image_variants, product_count
+            FROM categories WHERE is_active = TRUE ORDER BY sort_order, id
+        """)
+        shards['categories'] = {'categories': [dict(r) for r in cur.fetchall()]}
+    if 'products' in groups:
+        # Поля, join и фильтры списка товаров catalog-public (PRODUCT_LIST_FIELDS, product_filters):
+        # активность категории список не проверяет. Товары без категории в шарды не попадают.
+        cur.execute("""
+            SELECT p.id, p.name, p.category_slug, c.name AS category_name,
+                   p.price, p.image_url, p.in_stock, p.sku
+            FROM products p
+            LEFT JOIN categories c ON c.slug = p.category_slug
+            WHERE p.is_active = TRUE AND p.category_slug IS NOT NULL
+              AND (%s::text[] IS NULL OR p.category_slug = ANY(%s::text[]))
+            ORDER BY p.category_slug, p.sort_order, p.id
+        """, (product_slugs, product_slugs))
+        by_category = {}
+        for r in cur.fetchall():
+            by_category.setdefault(r['category_slug'], []).append(dict(r))
+        for slug, rows in by_category.items():
+            shards[f'products/{slug}'] = {'products': rows}
+    if 'articles' in groups:
+        cur.execute("""
+            SELECT id, slug, title, excerpt, image_url, category, read_time, created_at
+            FROM articles WHERE is_published = TRUE
+            ORDER BY sort_order, created_at DESC
+        """)
+        shards['articles'] = {'articles': [dict(r) for r in cur.fetchall()]}
+    if 'banners' in groups:
+        cur.execute("""
+            SELECT id, title, description, image_url, image_variants, badge, button_text, button_url, gradient,
+                   is_active, sort_order, created_at
+            FROM banners WHERE is_active=TRUE ORDER BY sort_order, id
+        """)
+        shards['banners'] = {'banners': [dict(r) for r in cur.fetchall()]}
+    if 'promotions' in groups:
+        cur.execute("""
+            SELECT id, title, description, badge, badge_value, button_text, button_url, expires_at,
+                   is_active, sort_order, created_at
+            FROM promotions WHERE is_active=TRUE ORDER BY sort_order, id
+        """)
+        shards['promotions'] = {'promotions': [dict(r) for r in cur.fetchall()]}
+    if 'settings' in groups:
+        cur.execute("SELECT key, value FROM settings")
+        shards['settings'] = {'settings': {r['key']: r['value'] for r in cur.fetchall()}}
+    return shards
+
+
+def shard_group(name):
+    return name.split('/', 1)[0]
+
+
+def publish_snapshot(groups=None):
+    """
+    Рендерит шарды и загружает только изменившиеся. Имя файла содержит хэш
+    содержимого, поэтому шарды неизменяемы и кэшируются навсегда; актуальные
+    ссылки перечислены в manifest.json, который перезаписывается последним.
+    После правок пересобираются только шарды товаров затронутых категорий:
+    manifest хранит водяной знак (pg_snapshot_xmin снимка) последней сборки товаров.
+    Без groups (ручная публикация) всё собирается заново.
+    """
+    full = not groups
+    groups = set(groups or ('categories', 'products', 'articles', 'banners', 'promotions', 'settings'))
+    store = get_store()
+    previous = store.read_manifest() or {'version': 0, 'shards': {}}
+    watermark = previous.get('watermark')
+
+    product_slugs = None
     with get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT key, value, label FROM settings ORDER BY key")
-            rows = cur.fetchall()
-    return resp(200, {'settings': {r['key']: {'value': r['value'], 'label': r['label']} for r in rows}})
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            if 'products' in groups:
+                if watermark and not full:
+                    product_slugs = dirty_product_slugs(cur, watermark)
+                cur.execute("SELECT DISTINCT category_slug FROM products WHERE is_active = TRUE")
+                listed_slugs = {r['category_slug'] for r in cur.fetchall()}
+                cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS watermark")
+                watermark = cur.fetchone()['watermark']
+            shards = render_shards(cur, groups, product_slugs)
+
+    entries = {name: e for name, e in previous['shards'].items() if shard_group(name) not in groups}
+    if product_slugs is not None:
+        # Шарды нетронутых категорий остаются как были; уходят шарды категорий,
+        # в которых не осталось активных товаров (в том числе после переименования).
+        dirty = set(product_slugs)
+        for name, e in previous['shards'].items():
+            slug = name.split('/', 1)[-1]
+            if shard_group(name) == 'products' and slug not in dirty and slug in listed_slugs:
+                entries[name] = e
+    written = []
+    for name, data in sorted(shards.items()):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode()
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        old = previous['shards'].get(name)
+        if old and old['hash'] == digest:
+            entries[name] = old
+            continue
+        key = f'{SNAPSHOT_PREFIX}/{name}.{digest}.json'
+        store.put(key, body, 'public, max-age=31536000, immutable')
+        entries[name] = {'key': key, 'url': store.url(key), 'hash': digest, 'bytes': len(body)}
+        written.append(name)
+
+    if not written and set(entries) == set(previous['shards']):
+        return {**previous, 'written': []}
+
+    manifest = {
+        'version': previous['version'] + 1,
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'watermark': watermark,
+        'shards': entries,
+    }
+    store.put(f'{SNAPSHOT_PREFIX}/manifest.json', json.dumps(manifest, ensure_ascii=False).encode(), 'no-cache')
+    return {**manifest, 'written': written}
 
 
-def save_settings(body):
-    updates = body.get('settings', {})
-    if not updates:
-        return resp(400, {'error': 'Нет данных'})
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            for key, value in updates.items():
+# ---- Feeds ----
+
+FEED_PREFIX = 'catalog/feeds'
+FEED_BATCH_SIZE = int(os.environ.get('FEED_BATCH_SIZE', '2000'))
+FEED_SITE_URL = os.environ.get('FEED_SITE_URL', 'https://tkexclusiv.ru')
+FEED_FORMATS = {
+    'yml': 'application/xml; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class S3StreamWriter:
+    """Пишет объект в бакет multipart-загрузкой: в памяти не больше одной части."""
+    PART_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, client, bucket, key, content_type):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type,
+        )['UploadId']
+        self.parts = []
+        self.buffer = bytearray()
+        self.bytes = 0
+
+    def write(self, text):
+        data = text.encode()
+        self.buffer += data
+        self.bytes += len(data)
+        if len(self.buffer) >= self.PART_SIZE:
+            self._flush()
+
+    def _flush(self):
+        part_number = len(self.parts) + 1
+        result = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer),
+        )
+        self.parts.append({'ETag': result['ETag'], 'PartNumber': part_number})
+        self.buffer.clear()
+
+    def close(self):
+        if self.buffer or not self.parts:
+            self._flush()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts},
+        )
+
+    def abort(self):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class LocalStreamWriter:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.tmp = f'{path}.tmp'
+        self.file = open(self.tmp, 'w', encoding='utf-8')
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode())
+        self.file.write(text)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp)
+
+
+def feed_since_condition(since):
+    """
+    Водяной знак — pg_snapshot_xmin снимка прошлой выгрузки (цифры): все транзакции
+    младше него уже завершены, поэтому change_xid >= знак не теряет строки, записанные
+    транзакцией, которая началась до выгрузки, а закоммитилась после. Знак-время остался
+    от прежних выгрузок и применяется с >=: лучше повторить строку, чем потерять.
+    """
+    if since.isdigit():
+        return "p.change_xid >= %s::xid8", [since]
+    return "p.updated_at >= %s", [since]
+
+
+def iter_feed_products(conn, since=None):
+    """Товары пачками через именованный (серверный) курсор: память не зависит от размера каталога."""
+    condition, values = feed_since_condition(since) if since else ("p.is_active = TRUE", [])
+    with conn.cursor(name='feed_export', cursor_factory=RealDictCursor) as cur:
+        cur.itersize = FEED_BATCH_SIZE
+        cur.execute(f"""
+            SELECT p.id, p.name, p.category_slug, p.price, p.description, p.image_url,
+                   p.in_stock, p.is_active, p.sku, p.specifications, p.updated_at,
+                   c.id AS category_id, c.name AS category_name
+            FROM products p
+            LEFT JOIN categories c ON c.slug = p.category_slug
+            WHERE {condition}
+            ORDER BY p.id
+        """, values)
+        while True:
+            rows = cur.fetchmany(FEED_BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
+
+def yml_offer(p):
+    available = 'true' if p['is_active'] and p['in_stock'] else 'false'
+    parts = [
+        f'<offer id="{p["id"]}" available="{available}">',
+        f'<url>{xml_escape(FEED_SITE_URL)}/catalog?product={p["id"]}</url>',
+        f'<price>{p["price"]}</price>',
+        '<currencyId>RUR</currencyId>',
+    ]
+    if p['category_id'] is not None:
+        parts.append(f'<categoryId>{p["category_id"]}</categoryId>')
+    if p['image_url']:
+        parts.append(f'<picture>{xml_escape(p["image_url"])}</picture>')
+    parts.append(f'<name>{xml_escape(p["name"])}</name>')
+    if p['sku']:
+        parts.append(f'<vendorCode>{xml_escape(p["sku"])}</vendorCode>')
+    if p['description']:
+        parts.append(f'<description>{xml_escape(p["description"])}</description>')
+    specs = p['specifications'] if isinstance(p['specifications'], dict) else {}
+    for name, value in specs.items():
+        if name and value not in (None, ''):
+            parts.append(f'<param name={xml_quoteattr(str(name))}>{xml_escape(str(value))}</param>')
+    parts.append('</offer>\n')
+    return ''.join(parts)
+
+
+def yml_header(cur):
+    cur.execute("SELECT key, value FROM settings WHERE key IN ('company_name')")
+    settings = {r['key']: r['value'] for r in cur.fetchall()}
+    cur.execute("SELECT id, name FROM categories WHERE is_active = TRUE ORDER BY sort_order, id")
+    categories = ''.join(
+        f'<category id="{r["id"]}">{xml_escape(r["name"])}</category>\n' for r in cur.fetchall()
+    )
+    company = xml_escape(settings.get('company_name', ''))
+    date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<yml_catalog date="{date}">\n<shop>\n'
+        f'<name>{company}</name>\n<company>{company}</company>\n<url>{xml_escape(FEED_SITE_URL)}</url>\n'
+        '<currencies><currency id="RUR" rate="1"/></currencies>\n'
+        f'<categories>\n{categories}</categories>\n<offers>\n'
+    )
+
+
+def export_feed(fmt, incremental=False):
+    """
+    Выгружает каталог в YML (Яндекс) или NDJSON потоково: пачка строк из серверного
+    курсора сразу пишется в объект, ничего не копится целиком. Инкрементальный фид
+    содержит только товары, изменённые после снимка прошлого запуска (включая снятые с продажи).
+    """
+    store = get_store()
+    state_key = f'{FEED_PREFIX}/{fmt}.state.json'
+    state = json.loads(store.get(state_key) or b'{}')
+    since = state.get('watermark') if incremental else None
+    name = f"{fmt}-{'delta' if since else 'full'}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}"
+    key = f'{FEED_PREFIX}/{name}.{"xml" if fmt == "yml" else fmt}'
+
+    started = time.monotonic()
+    rows_total, batches = 0, 0
+    writer = store.open_writer(key, FEED_FORMATS[fmt])
+    try:
+        with get_conn() as conn:
+            # Один снимок на всю выгрузку; его xmin — водяной знак следующего инкремента.
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS watermark")
+                watermark = cur.fetchone()['watermark']
+                if fmt == 'yml':
+                    writer.write(yml_header(cur))
+            for rows in iter_feed_products(conn, since):
+                batches += 1
+                rows_total += len(rows)
+                if fmt == 'yml':
+                    writer.write(''.join(yml_offer(r) for r in rows))
+                else:
+                    writer.write(''.join(json.dumps(dict(r), ensure_ascii=False, default=str) + '\n' for r in rows))
+        if fmt == 'yml':
+            writer.write('</offers>\n</shop>\n</yml_catalog>\n')
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    elapsed = time.monotonic() - started
+    store.put(state_key, json.dumps({'watermark': watermark, 'last_key': key}).encode(), 'no-cache')
+    return {
+        'key': key,
+        'url': store.url(key),
+        'incremental': bool(since),
+        'since': since,
+        'watermark': watermark,
+        'rows': rows_total,
+        'batches': batches,
+        'bytes': writer.bytes,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows_total / elapsed) if elapsed else rows_total,
+    }
+
+
+# ---- Import ----
+
+IMPORT_MAX_ERRORS = 1000
+IMPORT_COLUMNS = (
+    'sku', 'name', 'category_slug', 'price', 'description', 'image_url',
+    'in_stock', 'sort_order', 'is_active', 'specifications',
+)
+IMPORT_TEXT_COLUMNS = ('sku', 'name', 'category_slug', 'description', 'image_url')
+IMPORT_MAX_LENGTHS = {'sku': 100, 'name': 255, 'category_slug': 100}
+# price NUMERIC(10,2): граница проверяется после округления до копеек, как это сделает Postgres.
+IMPORT_MAX_PRICE = Decimal('100000000')
+PRICE_QUANTUM = Decimal('0.01')
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+# \u0000 в JSON-тексте (не экранированный обратной косой): jsonb его не принимает.
+JSON_NUL_RE = re.compile(r'(?<!\\)(?:\\\\)*\\u0000')
+TRUE_VALUES = {'1', 'true', 'yes', 'да', '+'}
+FALSE_VALUES = {'0', 'false', 'no', 'нет', '-'}
+
+
+class RowStream:
+    """Файлоподобный объект для COPY: строки формируются по мере чтения, без буфера на весь файл."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            chunk, self.buffer = self.buffer, ''
+        else:
+            chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def copy_field(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def parse_bool(value):
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'не булево значение: {value}')
+
+
+def normalize_import_row(raw):
+    """
+    Строка файла -> значения колонок импорта. Пустое значение = «не менять» (NULL).
+    Всё, что отверг бы COPY (вложенные значения, NUL, переполнение типов), отсекается здесь,
+    чтобы ошибка пришла по строке, а не сорвала весь импорт.
+    """
+    row = {}
+    for col in IMPORT_COLUMNS:
+        value = raw.get(col)
+        if col != 'specifications' and isinstance(value, (dict, list)):
+            raise ValueError(f'{col}: ожидалось простое значение, а не объект или список')
+        if isinstance(value, str):
+            if '\x00' in value:
+                raise ValueError(f'{col}: недопустимый символ NUL')
+            value = value.strip()
+            if value == '':
+                value = None
+        row[col] = value
+
+    if not row['sku']:
+        raise ValueError('sku обязателен')
+    for col in IMPORT_TEXT_COLUMNS:
+        if isinstance(row[col], bool):
+            raise ValueError(f'{col}: ожидалась строка')
+        if row[col] is not None:
+            row[col] = str(row[col])
+    for col, max_length in IMPORT_MAX_LENGTHS.items():
+        if row[col] is not None and len(str(row[col])) > max_length:
+            raise ValueError(f'{col} длиннее {max_length} символов')
+    if row['price'] is not None:
+        try:
+            row['price'] = Decimal(str(row['price']).replace(' ', '').replace(',', '.'))
+        except InvalidOperation:
+            raise ValueError(f"некорректная цена: {raw.get('price')}")
+        if not row['price'].is_finite() or not 0 <= row['price'] < IMPORT_MAX_PRICE:
+            raise ValueError(f"некорректная цена: {raw.get('price')}")
+        row['price'] = row['price'].quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+        if row['price'] >= IMPORT_MAX_PRICE:
+            raise ValueError(f"некорректная цена: {raw.get('price')}")
+    for col in ('in_stock', 'is_active'):
+        value = row[col]
+        if isinstance(value, str):
+            row[col] = parse_bool(value)
+        elif not isinstance(value, bool) and value in (0, 1):
+            row[col] = bool(value)
+        elif value is not None and not isinstance(value, bool):
+            raise ValueError(f'не булево значение: {value}')
+    if row['sort_order'] is not None:
+        value = row['sort_order']
+        try:
+            if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+                raise ValueError
+            row['sort_order'] = int(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"некорректный sort_order: {raw.get('sort_order')}")
+        if not INT_MIN <= row['sort_order'] <= INT_MAX:
+            raise ValueError(f"некорректный sort_order: {raw.get('sort_order')}")
+    specs = row['specifications']
+    if isinstance(specs, str):
+        try:
+            specs = json.loads(specs)
+        except ValueError:
+            raise ValueError('specifications должен быть JSON-объектом')
+    if specs is not None and not isinstance(specs, dict):
+        raise ValueError('specifications должен быть JSON-объектом')
+    try:
+        # NaN/Infinity json.loads пропускает, а jsonb — нет.
+        row['specifications'] = json.dumps(specs, ensure_ascii=False, allow_nan=False) if specs is not None else None
+    except ValueError:
+        raise ValueError('specifications: недопустимое число')
+    if row['specifications'] is not None and JSON_NUL_RE.search(row['specifications']):
+        raise ValueError('specifications: недопустимый символ NUL')
+    return row
+
+
+def iter_import_records(lines, fmt, delimiter=None):
+    """(номер строки, dict) для CSV с заголовком или NDJSON; читает построчно."""
+    if fmt == 'ndjson':
+        for number, line in enumerate(lines, start=1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield number, ValueError('некорректный JSON')
+                    continue
+                yield number, record if isinstance(record, dict) else ValueError('ожидался JSON-объект')
+        return
+
+    header = next(lines, '')
+    if not delimiter:
+        delimiter = ';' if header.count(';') > header.count(',') else ','
+    columns = [c.strip().lstrip('\ufeff') for c in next(csv.reader([header], delimiter=delimiter))]
+    # Номер — первая физическая строка записи: поле в кавычках может занимать несколько строк.
+    reader = csv.reader(lines, delimiter=delimiter)
+    end = 1
+    for values in reader:
+        number, end = end + 1, reader.line_num + 1
+        if any(v.strip() for v in values):
+            yield number, dict(zip(columns, values))
+
+
+def import_products(event, params):
+    """
+    Массовый импорт товаров с обновлением по sku. Тело — CSV (с заголовком) или NDJSON,
+    либо source=<ключ> объекта в хранилище, который читается потоком. Строки валидируются
+    по одной и сразу уходят через COPY во временную таблицу; дальше всё делается
+    несколькими set-based запросами. dry_run=1 выполняет импорт и откатывает транзакцию.
+    """
+    fmt = params.get('format') or ('ndjson' if 'ndjson' in (get_header(event, 'Content-Type') or '') else 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return resp(400, {'error': 'format: допустимые значения csv, ndjson'})
+    dry_run = params.get('dry_run') in ('1', 'true')
+
+    if params.get('source'):
+        reader = get_store().open_reader(params['source'])
+    else:
+        raw = event.get('body') or ''
+        if event.get('isBase64Encoded'):
+            raw = base64.b64decode(raw).decode('utf-8')
+        reader = io.StringIO(raw)
+
+    errors = []
+    stats = {'received': 0, 'valid': 0}
+
+    def add_error(line, sku, message):
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({'line': line, 'sku': sku, 'error': message})
+
+    def copy_lines():
+        for number, record in iter_import_records(iter(reader), fmt, params.get('delimiter')):
+            stats['received'] += 1
+            if isinstance(record, Exception):
+                add_error(number, None, str(record))
+                continue
+            try:
+                row = normalize_import_row(record)
+            except ValueError as e:
+                add_error(number, record.get('sku'), str(e))
+                continue
+            stats['valid'] += 1
+            yield '\t'.join([str(number)] + [copy_field(row[c]) for c in IMPORT_COLUMNS]) + '\n'
+
+    started = time.monotonic()
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO settings (key, value, updated_at)
-                    VALUES (%s, %s, NOW())
-                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
-                """, (key, str(value)))
-        conn.commit()
-    return resp(200, {'saved': True})
\ No newline at end of file
+                    CREATE TEMP TABLE import_rows (
+                        line INTEGER, sku VARCHAR(100), name VARCHAR(255), category_slug VARCHAR(100),
+                        price NUMERIC(10, 2), description TEXT, image_url TEXT, in_stock BOOLEAN,
+                        sort_order INTEGER, is_active BOOLEAN, specifications JSONB
+                    ) ON COMMIT DROP
+                """)
+                cur.copy_expert(
+                    f"COPY import_rows (line, {', '.join(IMPORT_COLUMNS)}) FROM STDIN",
+                    RowStream(copy_lines()),
+                )
+                result = apply_import(cur, add_error)
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+    finally:
+        reader.close()
+
+    elapsed = time.monotonic() - started
+    return resp(200, {
+        **stats,
+        **result,
+        'dry_run': dry_run,
+        'errors': errors,
+        'errors_truncated': len(errors) >= IMPORT_MAX_ERRORS,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(stats['received'] / elapsed) if elapsed else stats['received'],
+    })
+
+
+def apply_import(cur, add_error):
+    # Повторы sku внутри файла: применяется последняя строка.
+    cur.execute("""
+        DELETE FROM import_rows i
+        USING (
+            SELECT line, sku, MAX(line) OVER (PARTITION BY sku) AS last_line FROM import_rows
+        ) d
+        WHERE i.line = d.line AND d.line <> d.last_line
+        RETURNING i.line, i.sku, d.last_line
+    """)
+    for line, sku, last_line in cur.fetchall():
+        add_error(line, sku, f'повтор артикула, применена строка {last_line}')
+
+    cur.execute("""
+        DELETE FROM import_rows i
+        WHERE i.category_slug IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.slug = i.category_slug)
+        RETURNING i.line, i.sku, i.category_slug
+    """)
+    for line, sku, slug in cur.fetchall():
+        add_error(line, sku, f'категория не найдена: {slug}')
+
+    cur.execute("LOCK TABLE products IN SHARE ROW EXCLUSIVE MODE")
+
+    cur.execute("""
+        DELETE FROM import_rows i
+        WHERE i.name IS NULL
+          AND NOT EXISTS (SELECT 1 FROM products p WHERE p.sku = i.sku)
+        RETURNING i.line, i.sku
+    """)
+    for line, sku in cur.fetchall():
+        add_error(line, sku, 'name обязателен для нового товара')
+
+    cur.execute("""
+        UPDATE products p SET
+            name = COALESCE(i.name, p.name),
+            category_slug = COALESCE(i.category_slug, p.category_slug),
+            price = COALESCE(i.price, p.price),
+            description = COALESCE(i.description, p.description),
+            image_url = COALESCE(i.image_url, p.image_url),
+            in_stock = COALESCE(i.in_stock, p.in_stock),
+            sort_order = COALESCE(i.sort_order, p.sort_order),
+            is_active = COALESCE(i.is_active, p.is_active),
+            specifications = COALESCE(i.specifications, p.specifications),
+            updated_at = NOW()
+        FROM import_rows i
+        WHERE p.sku = i.sku
+    """)
+    updated = cur.rowcount
+
+    cur.execute("""
+        INSERT INTO products (sku, name, category_slug, price, description, image_url,
+                              in_stock, sort_order, is_active, specifications)
+        SELECT i.sku, i.name, i.category_slug, COALESCE(i.price, 0), i.description, i.image_url,
+               COALESCE(i.in_stock, TRUE), COALESCE(i.sort_order, 0), COALESCE(i.is_active, TRUE),
+               COALESCE(i.specifications, '{}'::jsonb)
+        FROM import_rows i
+        WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.sku = i.sku)
+    """)
+    created = cur.rowcount
+    return {'created': created, 'updated': updated}
+
@@ -1,21 +1,160 @@
 """
 Публичное API каталога: список категорий и товаров для отображения на сайте.
 """
+import base64
+import gzip
+import hashlib
 import json
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlencode
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, new_type, register_type
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag, X-Cache, Content-Encoding',
 }
 
 
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+
+class ConnectionPool:
+    """Пул соединений, живущий столько же, сколько тёплый инстанс функции."""
+
+    def __init__(self, minconn, maxconn, ping_after):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.ping_after = ping_after
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'discarded': 0}
+
+    def _connect(self):
+        return psycopg2.connect(os.environ['DATABASE_URL'])
+
+    def _alive(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        with self._lock:
+            if self._in_use >= self.maxconn:
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+            self._in_use += 1
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    break
+                conn, idle_since = item
+                # Проверка соединения (возможно, с пингом) идёт без блокировки, счётчики — под ней.
+                alive = self._alive(conn, idle_since)
+                with self._lock:
+                    if alive:
+                        self.stats['reuses'] += 1
+                    else:
+                        self.stats['discarded'] += 1
+                        self.stats['reconnects'] += 1
+                if alive:
+                    return conn
+                self._discard(conn)
+            conn = self._connect()
+            with self._lock:
+                self.stats['connects'] += 1
+                missing = self.minconn - self._in_use - len(self._idle)
+            for _ in range(max(missing, 0)):
+                extra = self._connect()
+                with self._lock:
+                    self.stats['connects'] += 1
+                    self._idle.append((extra, time.monotonic()))
+            return conn
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+            raise
+
+    def putconn(self, conn, broken=False):
+        with self._lock:
+            self._in_use -= 1
+            keep = not broken and not conn.closed and len(self._idle) < self.maxconn
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self.stats['discarded'] += 1
+        if not keep:
+            self._discard(conn)
+
+    def snapshot(self):
+        with self._lock:
+            total = self.stats['connects'] + self.stats['reuses']
+            return {
+                **self.stats,
+                'hit_rate': round(self.stats['reuses'] / total, 4) if total else 0.0,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'min': self.minconn,
+                'max': self.maxconn,
+            }
+
+
+POOL = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_PING_AFTER)
+
+
+@contextmanager
 def get_conn():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = POOL.getconn()
+    broken = False
+    try:
+        with conn:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        POOL.putconn(conn, broken=broken or bool(conn.closed))
 
 
 def resp(status, data):
@@ -26,125 +165,1122 @@ def resp(status, data):
     }
 
 
+def raw_resp(status, body):
+    return {
+        'statusCode': status,
+        'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+        'body': body,
+    }
+
+
+# ---- Serialization ----
+
+# NUMERIC, даты и json приходят из драйвера текстом как есть: не создаём Decimal/datetime,
+# которые json.dumps всё равно превратил бы в строку через default=str.
+# Формат совпадает со str(Decimal) для цен; jsonb по-прежнему разбирается в dict.
+PASSTHROUGH_OIDS = {
+    'NUMERIC_TEXT': (1700,),
+    'DATE_TEXT': (1082,),
+    'TIMESTAMP_TEXT': (1114, 1184),
+    'JSON_TEXT': (114,),
+}
+for _name, _oids in PASSTHROUGH_OIDS.items():
+    register_type(new_type(_oids, _name, lambda value, cur: value))
+
+
+def fetch_dicts(cur):
+    names = [d[0] for d in cur.description]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def fetch_dict(cur):
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in cur.description], row))
+
+
+# ---- Response cache ----
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '512'))
+
+CACHE_INVALIDATION = os.environ.get('CACHE_INVALIDATION', '1') == '1'
+
+# (с инвалидацией, без неё): долгий TTL безопасен, только пока слушатель сбрасывает
+# записи при изменениях; с CACHE_INVALIDATION=0 TTL — единственная граница устаревания.
+CACHE_TTL = {
+    resource: int(os.environ.get(f'CACHE_TTL_{resource.upper()}', defaults[0 if CACHE_INVALIDATION else 1]))
+    for resource, defaults in {
+        'categories': (1800, 300),
+        'products': (600, 60),
+        'product': (1800, 300),
+        'articles': (1800, 300),
+        'banners': (1800, 300),
+        'promotions': (1800, 300),
+        'settings': (3600, 600),
+        'bootstrap': (600, 60),
+        'changes': (60, 60),
+    }.items()
+}
+
+
+class ResponseCache:
+    """LRU-кэш готовых ответов (тело и ETag) с TTL на каждую запись."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate_tables(self, tables):
+        """Удаляет записи, ответ которых зависит от любой из изменившихся таблиц."""
+        with self._lock:
+            stale = [k for k, (_, value) in self._entries.items() if tables & set(value['deps'])]
+            for key in stale:
+                del self._entries[key]
+            self.stats['invalidations'] += len(stale)
+            return len(stale)
+
+    def snapshot(self):
+        with self._lock:
+            total = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': round(self.stats['hits'] / total, 4) if total else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+CACHE = ResponseCache(CACHE_MAX_ENTRIES)
+
+
+# ---- Invalidation ----
+
+INVALIDATION_CHANNEL = 'catalog_changes'
+VERSION_CHECK_INTERVAL = float(os.environ.get('VERSION_CHECK_INTERVAL', '30'))
+
+
+class InvalidationListener:
+    """
+    Слушает канал catalog_changes (NOTIFY из триггеров V0014/V0020) на отдельном
+    autocommit-соединении и сбрасывает записи кэша изменившихся таблиц.
+    Инстанс функции заморожен между вызовами, поэтому уведомления разбираются
+    в начале каждого запроса: poll() читает только то, что уже пришло в сокет.
+    Если соединение рвалось или уведомление потерялось, раз в VERSION_CHECK_INTERVAL
+    секунд версии сверяются с таблицей catalog_versions.
+    """
+
+    def __init__(self, cache, check_interval):
+        self.cache = cache
+        self.check_interval = check_interval
+        self.conn = None
+        self.versions = {}
+        self.checked_at = 0.0
+        self.stats = {'notifications': 0, 'version_checks': 0, 'listen_connects': 0, 'invalidated': 0}
+
+    def _listen(self):
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {INVALIDATION_CHANNEL}')
+        self.conn = conn
+        self.stats['listen_connects'] += 1
+        # Пока не слушали, уведомления могли пройти мимо.
+        self.checked_at = 0.0
+
+    def _drain(self):
+        self.conn.poll()
+        changed = set()
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            # Полезная нагрузка — имя таблицы (V0020).
+            self.stats['notifications'] += 1
+            changed.add(notify.payload)
+        return changed
+
+    def _read_versions(self, tables=None):
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                if tables is None:
+                    cur.execute("SELECT resource, version FROM catalog_versions")
+                else:
+                    cur.execute("SELECT resource, version FROM catalog_versions WHERE resource = ANY(%s)",
+                                (sorted(tables),))
+                return dict(cur.fetchall())
+
+    def _check_versions(self):
+        current = self._read_versions()
+        changed = {t for t, v in current.items() if self.versions.get(t) != v}
+        self.versions = current
+        self.checked_at = time.monotonic()
+        self.stats['version_checks'] += 1
+        return changed
+
+    def sync(self):
+        changed = set()
+        try:
+            if self.conn is None or self.conn.closed:
+                self._listen()
+            changed |= self._drain()
+        except psycopg2.Error as e:
+            print(f'Invalidation listener error: {e}')
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            self.checked_at = 0.0
+        if changed:
+            # Версии из уведомления не приходят: без перечитывания следующая сверка
+            # сочла бы ту же правку новой и сбросила уже пересобранные записи.
+            try:
+                self.versions.update(self._read_versions(changed))
+            except psycopg2.Error as e:
+                print(f'Version read failed: {e}')
+        if time.monotonic() - self.checked_at >= self.check_interval:
+            try:
+                changed |= self._check_versions()
+            except psycopg2.Error as e:
+                print(f'Version check failed: {e}')
+        if changed:
+            self.stats['invalidated'] += self.cache.invalidate_tables(changed)
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            'listening': self.conn is not None and not self.conn.closed,
+            'versions': dict(self.versions),
+        }
+
+
+LISTENER = InvalidationListener(CACHE, VERSION_CHECK_INTERVAL)
+
+
+def cache_key(resource, params):
+    query = {k: v.strip() for k, v in params.items() if k != 'resource' and v and v.strip()}
+    return (resource, urlencode(sorted(query.items())))
+
+
+# ---- Conditional responses ----
+
+CACHE_CONTROL = {
+    'categories': 'public, max-age=60, stale-while-revalidate=600',
+    'products': 'public, max-age=30, stale-while-revalidate=300',
+    'product': 'public, max-age=60, stale-while-revalidate=600',
+    'articles': 'public, max-age=300, stale-while-revalidate=3600',
+    'banners': 'public, max-age=120, stale-while-revalidate=900',
+    'promotions': 'public, max-age=120, stale-while-revalidate=900',
+    'settings': 'public, max-age=300, stale-while-revalidate=3600',
+    'bootstrap': 'public, max-age=30, stale-while-revalidate=300',
+    'changes': 'public, max-age=0, must-revalidate',
+}
+
+# От каких таблиц зависит ответ ресурса: ETag меняется при изменении любой из них.
+RESOURCE_DEPS = {
+    'categories': ('categories',),
+    'products': ('products', 'categories'),
+    'product': ('products', 'categories'),
+    'articles': ('articles',),
+    'banners': ('banners',),
+    'promotions': ('promotions',),
+    'settings': ('settings',),
+}
+
+
+def resource_deps(resource, params):
+    if resource not in ('bootstrap', 'changes'):
+        return RESOURCE_DEPS[resource]
+    sections = parse_sections(params.get('sections')) or ()
+    return tuple(sorted({t for s in sections for t in RESOURCE_DEPS[s]}))
+
+
+def get_header(event, name):
+    name = name.lower()
+    for k, v in (event.get('headers') or {}).items():
+        if k.lower() == name:
+            return v
+    return None
+
+
+def get_versions(tables):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT resource, version FROM catalog_versions WHERE resource = ANY(%s)",
+                (list(tables),),
+            )
+            return dict(cur.fetchall())
+
+
+def make_etag(key, versions):
+    raw = f"{key[0]}?{key[1]}|" + ','.join(f"{t}:{versions.get(t, 0)}" for t in sorted(versions))
+    return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Возвращает совпавший тег из If-None-Match (с суффиксом кодировки, если он был) или None."""
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == '*':
+        return etag
+    for tag in (t.strip() for t in if_none_match.split(',')):
+        if strip_encoding_suffix(tag) == etag:
+            return tag
+    return None
+
+
+def not_modified(resource, etag):
+    return {
+        'statusCode': 304,
+        'headers': {
+            **CORS_HEADERS,
+            'ETag': etag,
+            'Cache-Control': CACHE_CONTROL[resource],
+            'Vary': 'Accept-Encoding',
+        },
+        'body': '',
+    }
+
+
+# ---- Compression ----
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+
+def negotiate_encoding(accept_encoding):
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, q = part.strip().partition(';q=')
+        try:
+            accepted[name.strip().lower()] = float(q) if q else 1.0
+        except ValueError:
+            continue
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def strip_encoding_suffix(etag):
+    for suffix in ('-gzip"', '-br"'):
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def encode_response(result, encoding, entry=None):
+    """
+    Сжимает тело ответа, если клиент это поддерживает и тело больше порога.
+    Сжатые байты сохраняются в записи кэша, чтобы не сжимать повторно на каждом попадании.
+    """
+    if result['statusCode'] != 200 or not encoding:
+        return result
+    body = result['body']
+    if len(body) < COMPRESS_MIN_BYTES:
+        return result
+    encoded = entry.setdefault('encoded', {}).get(encoding) if entry is not None else None
+    if encoded is None:
+        raw = body.encode()
+        if len(raw) < COMPRESS_MIN_BYTES:
+            return result
+        encoded = base64.b64encode(compress(raw, encoding)).decode()
+        if entry is not None:
+            entry['encoded'][encoding] = encoded
+    headers = {**result['headers'], 'Content-Encoding': encoding}
+    if 'ETag' in headers:
+        headers['ETag'] = headers['ETag'][:-1] + f'-{encoding}"'
+    return {**result, 'headers': headers, 'body': encoded, 'isBase64Encoded': True}
+
+
 def handler(event: dict, context) -> dict:
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
+    if CACHE_INVALIDATION:
+        LISTENER.sync()
+
     params = event.get('queryStringParameters') or {}
     resource = params.get('resource', '')
 
+    if resource == 'stats':
+        return resp(200, {'pool': POOL.snapshot(), 'cache': CACHE.snapshot(), 'invalidation': LISTENER.snapshot()})
+
+    if resource not in CACHE_TTL:
+        return resp(404, {'error': 'Not found'})
+
+    if_none_match = get_header(event, 'If-None-Match')
+    encoding = negotiate_encoding(get_header(event, 'Accept-Encoding'))
+    key = cache_key(resource, params)
+    cached = CACHE.get(key)
+    if cached is not None:
+        matched = etag_matches(if_none_match, cached['etag'])
+        if matched:
+            return not_modified(resource, matched)
+        result = {
+            'statusCode': 200,
+            'headers': {
+                **CORS_HEADERS,
+                'Content-Type': 'application/json',
+                'ETag': cached['etag'],
+                'Cache-Control': CACHE_CONTROL[resource],
+                'Vary': 'Accept-Encoding',
+                'X-Cache': 'HIT',
+            },
+            'body': cached['body'],
+        }
+        return encode_response(result, encoding, cached)
+
+    # Параметры проверяются до обращения к базе: некорректный запрос не тратит round trip.
+    try:
+        load = route(resource, params)
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+
+    deps = resource_deps(resource, params)
+    etag = make_etag(key, get_versions(deps))
+    matched = etag_matches(if_none_match, etag)
+    if matched:
+        return not_modified(resource, matched)
+
+    result = load()
+    entry = None
+    if result['statusCode'] == 200:
+        entry = {'body': result['body'], 'etag': etag, 'deps': deps}
+        CACHE.put(key, entry, CACHE_TTL[resource])
+        result['headers']['ETag'] = etag
+        result['headers']['Cache-Control'] = CACHE_CONTROL[resource]
+        result['headers']['Vary'] = 'Accept-Encoding'
+    result['headers']['X-Cache'] = 'MISS'
+    return encode_response(result, encoding, entry)
+
+
+def route(resource, params):
+    """Разбирает параметры (ValueError — ответ 400) и возвращает функцию, которая строит ответ."""
     if resource == 'categories':
-        return get_categories()
+        return get_categories
 
     if resource == 'products':
-        category = params.get('category')
         search = params.get('search', '').strip()
-        return get_products(category, search)
+        facets = params.get('facets') in ('1', 'true')
+        fields = parse_fields(params.get('fields'))
+        filters = parse_filters(params)
+        if search:
+            limit = parse_limit(params.get('limit'))
+            return lambda: get_search_results(search, filters, limit, fields, facets)
+        if not (params.get('limit') or params.get('cursor')):
+            return lambda: get_products(filters, fields, facets)
+        limit = parse_limit(params.get('limit'))
+        after = decode_cursor(params.get('cursor'))
+        with_total = params.get('total') in ('1', 'true')
+        return lambda: get_products_page(filters, after, limit, with_total, fields, facets)
+
+    if resource == 'product':
+        product_id = params.get('id')
+        sku = params.get('sku', '').strip()
+        if not product_id and not sku:
+            raise ValueError('id или sku обязателен')
+        if product_id and not product_id.isdigit():
+            raise ValueError('id должен быть числом')
+        return lambda: get_product(product_id, sku)
 
     if resource == 'articles':
         article_id = params.get('id')
-        return get_article(article_id) if article_id else get_articles()
+        if article_id and not article_id.isdigit():
+            raise ValueError('id должен быть числом')
+        return (lambda: get_article(article_id)) if article_id else get_articles
 
     if resource == 'banners':
-        return get_banners()
+        return get_banners
 
     if resource == 'promotions':
-        return get_promotions()
+        return get_promotions
 
     if resource == 'settings':
-        return get_settings()
+        return get_settings
+
+    if resource == 'bootstrap':
+        sections = parse_sections(params.get('sections'))
+        if sections is None:
+            raise ValueError(f"sections: допустимые значения {', '.join(BOOTSTRAP_SECTIONS)}")
+        fields = parse_fields(params.get('fields'))
+        return lambda: get_bootstrap(sections, params.get('category'), fields)
 
-    return resp(404, {'error': 'Not found'})
+    if resource == 'changes':
+        sections = parse_sections(params.get('sections'))
+        if sections is None:
+            raise ValueError(f"sections: допустимые значения {', '.join(BOOTSTRAP_SECTIONS)}")
+        since = parse_since(params.get('since'))
+        fields = parse_fields(params.get('fields'))
+        return lambda: get_changes(sections, since, fields)
+
+    return lambda: resp(404, {'error': 'Not found'})
+
+
+def fetch_categories(cur):
+    cur.execute("""
+        SELECT c.id, c.slug, c.name, c.icon, c.image_url, c.image_variants, c.product_count
+        FROM categories c
+        WHERE c.is_active = TRUE
+        ORDER BY c.sort_order, c.id
+    """)
+    return fetch_dicts(cur)
 
 
 def get_categories():
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT c.id, c.slug, c.name, c.icon, c.image_url,
-                       COUNT(p.id) AS product_count
-                FROM categories c
-                LEFT JOIN products p ON p.category_slug = c.slug
-                    AND p.is_active = TRUE
-                WHERE c.is_active = TRUE
-                GROUP BY c.id
-                ORDER BY c.sort_order, c.id
-            """)
-            rows = cur.fetchall()
-    return resp(200, {'categories': [dict(r) for r in rows]})
-
-
-def get_products(category=None, search=None):
+        with conn.cursor() as cur:
+            rows = fetch_categories(cur)
+    return resp(200, {'categories': rows})
+
+
+PRODUCTS_DEFAULT_LIMIT = 50
+PRODUCTS_MAX_LIMIT = 200
+
+
+# Поле ответа -> SQL-выражение. Тяжёлые description, specifications и image_variants
+# отдаются в списке только по явному fields=, карточка товара — resource=product.
+PRODUCT_FIELDS = {
+    'id': 'p.id',
+    'name': 'p.name',
+    'category_slug': 'p.category_slug',
+    'category_name': 'c.name AS category_name',
+    'price': 'p.price',
+    'image_url': 'p.image_url',
+    'image_variants': 'p.image_variants',
+    'in_stock': 'p.in_stock',
+    'sku': 'p.sku',
+    'sort_order': 'p.sort_order',
+    'description': 'p.description',
+    'specifications': 'p.specifications',
+}
+
+PRODUCT_LIST_FIELDS = ('id', 'name', 'category_slug', 'category_name', 'price', 'image_url', 'in_stock', 'sku')
+
+# Те же поля для json_build_object; цена текстом, как в ответе из Python.
+PRODUCT_JSON_FIELDS = {
+    **{f: expr.split(' AS ')[0] for f, expr in PRODUCT_FIELDS.items()},
+    'price': 'p.price::text',
+}
+
+# python — строки кортежами и json.dumps; postgres — json_agg на стороне базы.
+PRODUCTS_SERIALIZER = os.environ.get('PRODUCTS_SERIALIZER', 'python')
+
+
+def parse_fields(raw):
+    if not raw or not raw.strip():
+        return PRODUCT_LIST_FIELDS
+    if raw.strip() == 'all':
+        return tuple(PRODUCT_FIELDS)
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(['id'] + fields))
+
+
+def product_columns(fields):
+    columns = ', '.join(PRODUCT_FIELDS[f] for f in fields)
+    join = "LEFT JOIN categories c ON c.slug = p.category_slug" if 'category_name' in fields else ''
+    return columns, join
+
+
+def product_filters(filters=None):
+    filters = filters or {}
     conditions = ["p.is_active = TRUE"]
     values = []
 
-    if category:
+    if filters.get('category'):
         conditions.append("p.category_slug = %s")
-        values.append(category)
+        values.append(filters['category'])
+
+    if filters.get('price_min') is not None:
+        conditions.append("p.price >= %s")
+        values.append(filters['price_min'])
+
+    if filters.get('price_max') is not None:
+        conditions.append("p.price <= %s")
+        values.append(filters['price_max'])
 
-    if search:
-        conditions.append("p.name ILIKE %s")
-        values.append(f'%{search}%')
+    if filters.get('in_stock') is not None:
+        conditions.append("p.in_stock = %s")
+        values.append(filters['in_stock'])
 
+    # Несколько значений одного ключа — ИЛИ, разные ключи — И. Оператор @> идёт по idx_products_specs.
+    for key, options in filters.get('specs', {}).items():
+        conditions.append('(' + ' OR '.join(["p.specifications @> %s::jsonb"] * len(options)) + ')')
+        values.extend(json.dumps({key: option}, ensure_ascii=False) for option in options)
+
+    return conditions, values
+
+
+def query_products(cur, conditions, values, limit=None, fields=PRODUCT_LIST_FIELDS):
+    columns, join = product_columns(fields)
     where = ' AND '.join(conditions)
+    cur.execute(f"""
+        SELECT {columns}
+        FROM products p
+        {join}
+        WHERE {where}
+        ORDER BY p.category_slug, p.sort_order, p.id
+        {'LIMIT %s' if limit is not None else ''}
+    """, values + ([limit] if limit is not None else []))
+    return fetch_dicts(cur)
+
 
+def fetch_products(cur, filters=None, fields=PRODUCT_LIST_FIELDS):
+    conditions, values = product_filters(filters)
+    return query_products(cur, conditions, values, fields=fields)
+
+
+def query_products_json(cur, conditions, values, fields=PRODUCT_LIST_FIELDS):
+    """Список товаров, собранный в JSON самим Postgres: Python не создаёт ни одного словаря на строку."""
+    pairs = ', '.join(f"'{f}', {PRODUCT_JSON_FIELDS[f]}" for f in fields)
+    _, join = product_columns(fields)
+    where = ' AND '.join(conditions)
+    cur.execute(f"""
+        SELECT coalesce(json_agg(json_build_object({pairs})
+                        ORDER BY p.category_slug, p.sort_order, p.id), '[]')
+        FROM products p
+        {join}
+        WHERE {where}
+    """, values)
+    return cur.fetchone()[0]
+
+
+def get_products(filters=None, fields=PRODUCT_LIST_FIELDS, facets=False):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if PRODUCTS_SERIALIZER == 'postgres':
+                conditions, values = product_filters(filters)
+                body = '{"products": ' + query_products_json(cur, conditions, values, fields)
+                if facets:
+                    body += ', "facets": ' + json.dumps(fetch_facets(cur, filters), ensure_ascii=False)
+                return raw_resp(200, body + '}')
+            data = {'products': fetch_products(cur, filters, fields)}
+            if facets:
+                data['facets'] = fetch_facets(cur, filters)
+    return resp(200, data)
+
+
+def get_product(product_id=None, sku=None):
+    columns, join = product_columns(tuple(PRODUCT_FIELDS))
+    if product_id:
+        condition, value = "p.id = %s", product_id
+    else:
+        condition, value = "p.sku = %s", sku
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor() as cur:
             cur.execute(f"""
-                SELECT p.id, p.name, p.category_slug, p.price,
-                       p.description, p.image_url, p.in_stock,
-                       p.sku, p.specifications,
-                       c.name AS category_name
+                SELECT {columns}
                 FROM products p
-                LEFT JOIN categories c ON c.slug = p.category_slug
-                WHERE {where}
-                ORDER BY p.category_slug, p.sort_order, p.id
-            """, values)
-            rows = cur.fetchall()
-    return resp(200, {'products': [dict(r) for r in rows]})
+                {join}
+                WHERE {condition} AND p.is_active = TRUE
+                LIMIT 1
+            """, (value,))
+            row = fetch_dict(cur)
+    if not row:
+        return resp(404, {'error': 'Товар не найден'})
+    return resp(200, {'product': row})
+
+
+# ---- Keyset pagination ----
+
+KEYSET_FIELDS = ('id', 'category_slug', 'sort_order')
+
+
+def parse_limit(raw):
+    if not raw:
+        return PRODUCTS_DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise ValueError('limit должен быть числом')
+    if limit < 1:
+        raise ValueError('limit должен быть больше 0')
+    return min(limit, PRODUCTS_MAX_LIMIT)
+
+
+def encode_cursor(row):
+    raw = json.dumps([row['category_slug'], row['sort_order'], row['id']], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        slug, sort_order, item_id = json.loads(raw)
+        if slug is not None and not isinstance(slug, str):
+            raise TypeError
+        return slug, int(sort_order), int(item_id)
+    except (ValueError, TypeError):
+        raise ValueError('Некорректный cursor')
+
+
+def fetch_products_after(cur, filters, after, limit, fields=PRODUCT_LIST_FIELDS):
+    """
+    Страница товаров строго после курсора в порядке (category_slug, sort_order, id).
+    Товары без категории идут в конце (NULLS LAST), поэтому сравнение кортежей
+    делается отдельно для ветки с категорией и для ветки без неё, чтобы каждая
+    ветка шла по индексу idx_products_active_order, а не сканировала таблицу.
+    """
+    conditions, values = product_filters(filters)
+    fields = tuple(dict.fromkeys(fields + KEYSET_FIELDS))
+
+    if after is None:
+        return query_products(cur, conditions, values, limit, fields)
+
+    slug, sort_order, item_id = after
+    if slug is None:
+        return query_products(
+            cur,
+            conditions + ["p.category_slug IS NULL", "(p.sort_order, p.id) > (%s, %s)"],
+            values + [sort_order, item_id],
+            limit,
+            fields,
+        )
+
+    rows = query_products(
+        cur,
+        conditions + ["(p.category_slug, p.sort_order, p.id) > (%s, %s, %s)"],
+        values + [slug, sort_order, item_id],
+        limit,
+        fields,
+    )
+    if len(rows) < limit and not filters.get('category'):
+        rows += query_products(cur, conditions + ["p.category_slug IS NULL"], values, limit - len(rows), fields)
+    return rows
+
+
+def get_products_page(filters, after, limit, with_total=False, fields=PRODUCT_LIST_FIELDS, facets=False):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            rows = fetch_products_after(cur, filters, after, limit + 1, fields)
+            total = None
+            if with_total:
+                conditions, values = product_filters(filters)
+                cur.execute(f"SELECT COUNT(*) AS total FROM products p WHERE {' AND '.join(conditions)}", values)
+                total = cur.fetchone()[0]
+            facet_counts = fetch_facets(cur, filters) if facets else None
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    # Колонки курсора, которых клиент не просил, не попадают в ответ: форма строк как у первой страницы.
+    extra = [f for f in KEYSET_FIELDS if f not in fields]
+    for row in rows:
+        for f in extra:
+            del row[f]
+    data = {'products': rows, 'next_cursor': next_cursor, 'limit': limit}
+    if with_total:
+        data['total'] = total
+    if facets:
+        data['facets'] = facet_counts
+    return resp(200, data)
+
+
+# ---- Facets ----
+
+FACET_MAX_VALUES = 50
+SPEC_PARAM_PREFIX = 'spec.'
+
+
+def parse_price(raw, name):
+    if raw is None or not raw.strip():
+        return None
+    try:
+        value = Decimal(raw.strip())
+    except InvalidOperation:
+        raise ValueError(f'{name} должен быть числом')
+    if not value.is_finite():
+        raise ValueError(f'{name} должен быть числом')
+    return value
+
+
+def parse_filters(params):
+    """
+    category, price_min, price_max, in_stock=1|0 и spec.<ключ>=<значение>[|<значение>...]
+    по характеристикам товара.
+    """
+    filters = {
+        'category': params.get('category') or None,
+        'price_min': parse_price(params.get('price_min'), 'price_min'),
+        'price_max': parse_price(params.get('price_max'), 'price_max'),
+        'in_stock': None,
+        'specs': {},
+    }
+    in_stock = params.get('in_stock')
+    if in_stock in ('1', 'true'):
+        filters['in_stock'] = True
+    elif in_stock in ('0', 'false'):
+        filters['in_stock'] = False
+    for name, raw in params.items():
+        if not name.startswith(SPEC_PARAM_PREFIX) or not raw:
+            continue
+        key = name[len(SPEC_PARAM_PREFIX):]
+        options = [v.strip() for v in raw.split('|') if v.strip()]
+        if key and options:
+            filters['specs'][key] = options
+    return filters
+
+
+def fetch_facets(cur, filters, extra=None):
+    """
+    Счётчики значений характеристик, наличия и диапазон цен по отфильтрованной выборке.
+    extra — (условие, параметры) сверх фильтров, например поисковое.
+    Выборка материализуется один раз, все агрегаты считаются по ней.
+    """
+    conditions, values = product_filters(filters)
+    if extra:
+        conditions, values = conditions + [extra[0]], values + extra[1]
+    cur.execute(f"""
+        WITH f AS MATERIALIZED (
+            SELECT p.specifications, p.price, p.in_stock
+            FROM products p
+            WHERE {' AND '.join(conditions)}
+        )
+        SELECT 'spec', kv.key, kv.value, COUNT(*)
+        FROM f CROSS JOIN LATERAL jsonb_each_text(f.specifications) kv
+        WHERE jsonb_typeof(f.specifications) = 'object' AND kv.value <> ''
+        GROUP BY kv.key, kv.value
+        UNION ALL
+        SELECT 'in_stock', NULL, f.in_stock::text, COUNT(*) FROM f GROUP BY f.in_stock
+        UNION ALL
+        SELECT 'price', MIN(f.price)::text, MAX(f.price)::text, COUNT(*) FROM f
+    """, values)
+
+    specs, in_stock, price, total = {}, {'true': 0, 'false': 0}, None, 0
+    for kind, key, value, count in cur.fetchall():
+        if kind == 'spec':
+            specs.setdefault(key, []).append({'value': value, 'count': count})
+        elif kind == 'in_stock' and value is not None:
+            in_stock[value] = count
+        elif kind == 'price':
+            price, total = {'min': key, 'max': value}, count
+    for key in specs:
+        specs[key] = sorted(specs[key], key=lambda v: (-v['count'], v['value']))[:FACET_MAX_VALUES]
+    return {'total': total, 'price': price, 'in_stock': in_stock, 'specs': specs}
+
+
+# ---- Search ----
+
+# Должно посимвольно совпадать с выражением индекса idx_products_search из V0011,
+# иначе планировщик не сможет использовать GIN-индекс.
+PRODUCT_SEARCH_VECTOR = """(
+    setweight(to_tsvector('russian', coalesce(p.name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(p.sku, '')), 'A') ||
+    setweight(jsonb_to_tsvector('russian', coalesce(p.specifications, '{}'::jsonb), '["string"]'), 'B') ||
+    setweight(to_tsvector('russian', coalesce(p.description, '')), 'C')
+)"""
+
+
+def build_tsquery(search):
+    """Слова запроса как префиксы: «пугов бел» найдёт «пуговицы белые» ещё при наборе."""
+    words = re.findall(r'\w+', search.lower())
+    return ' & '.join(f'{w}:*' for w in words)
+
+
+def search_condition(search):
+    """Условие совпадения с запросом и его параметры; общее для выдачи и фасетов."""
+    tsquery = build_tsquery(search)
+    if not tsquery:
+        return 'FALSE', []
+    return (
+        f"""({PRODUCT_SEARCH_VECTOR} @@ to_tsquery('russian', %s)
+             OR p.name %% %s
+             OR p.sku ILIKE %s)""",
+        [tsquery, search, f'{search}%'],
+    )
+
+
+def search_products(cur, search, filters=None, limit=PRODUCTS_DEFAULT_LIMIT, fields=PRODUCT_LIST_FIELDS):
+    """
+    Поиск по названию, артикулу, описанию и характеристикам с ранжированием.
+    Полнотекстовое совпадение (русская морфология) ранжируется выше,
+    триграммное сходство названия ловит опечатки, артикул ищется по префиксу.
+    """
+    tsquery = build_tsquery(search)
+    if not tsquery:
+        return []
+
+    conditions, values = product_filters(filters)
+    match, match_values = search_condition(search)
+    columns, _ = product_columns(fields)
+    where = ' AND '.join(conditions + [match])
+    cur.execute(f"""
+        WITH q AS (SELECT to_tsquery('russian', %s) AS tsq)
+        SELECT {columns}
+        FROM products p
+        CROSS JOIN q
+        LEFT JOIN categories c ON c.slug = p.category_slug
+        WHERE {where}
+        ORDER BY ts_rank_cd({PRODUCT_SEARCH_VECTOR}, q.tsq) * 2
+                     + similarity(p.name, %s)
+                     + CASE WHEN p.sku ILIKE %s THEN 1 ELSE 0 END DESC,
+                 p.id
+        LIMIT %s
+    """, [tsquery] + values + match_values + [search, f'{search}%', limit])
+    return fetch_dicts(cur)
+
+
+def get_search_results(search, filters, limit, fields=PRODUCT_LIST_FIELDS, facets=False):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            data = {'products': search_products(cur, search, filters, limit, fields)}
+            if facets:
+                data['facets'] = fetch_facets(cur, filters, search_condition(search))
+    return resp(200, data)
+
+
+# Явные списки колонок: служебный change_xid наружу не отдаётся.
+ARTICLE_COLUMNS = 'id, slug, title, excerpt, content, image_url, category, read_time, is_published, sort_order, created_at, updated_at'
+BANNER_COLUMNS = 'id, title, description, image_url, image_variants, badge, button_text, button_url, gradient, is_active, sort_order, created_at'
+PROMOTION_COLUMNS = 'id, title, description, badge, badge_value, button_text, button_url, expires_at, is_active, sort_order, created_at'
+
+
+def fetch_articles(cur):
+    cur.execute("""
+        SELECT id, slug, title, excerpt, image_url, category, read_time, created_at
+        FROM articles WHERE is_published = TRUE
+        ORDER BY sort_order, created_at DESC
+    """)
+    return fetch_dicts(cur)
 
 
 def get_articles():
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, slug, title, excerpt, image_url, category, read_time, created_at
-                FROM articles WHERE is_published = TRUE
-                ORDER BY sort_order, created_at DESC
-            """)
-            rows = cur.fetchall()
-    return resp(200, {'articles': [dict(r) for r in rows]})
+        with conn.cursor() as cur:
+            rows = fetch_articles(cur)
+    return resp(200, {'articles': rows})
 
 
 def get_article(article_id):
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM articles WHERE id=%s AND is_published=TRUE", (article_id,))
-            row = cur.fetchone()
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {ARTICLE_COLUMNS} FROM articles WHERE id=%s AND is_published=TRUE", (article_id,))
+            row = fetch_dict(cur)
     if not row:
         return resp(404, {'error': 'Статья не найдена'})
-    return resp(200, {'article': dict(row)})
+    return resp(200, {'article': row})
+
+
+def fetch_banners(cur):
+    cur.execute(f"SELECT {BANNER_COLUMNS} FROM banners WHERE is_active=TRUE ORDER BY sort_order, id")
+    return fetch_dicts(cur)
 
 
 def get_banners():
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM banners WHERE is_active=TRUE ORDER BY sort_order, id")
-            rows = cur.fetchall()
-    return resp(200, {'banners': [dict(r) for r in rows]})
+        with conn.cursor() as cur:
+            rows = fetch_banners(cur)
+    return resp(200, {'banners': rows})
+
+
+def fetch_promotions(cur):
+    cur.execute(f"SELECT {PROMOTION_COLUMNS} FROM promotions WHERE is_active=TRUE ORDER BY sort_order, id")
+    return fetch_dicts(cur)
 
 
 def get_promotions():
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM promotions WHERE is_active=TRUE ORDER BY sort_order, id")
-            rows = cur.fetchall()
-    return resp(200, {'promotions': [dict(r) for r in rows]})
+        with conn.cursor() as cur:
+            rows = fetch_promotions(cur)
+    return resp(200, {'promotions': rows})
+
+
+def fetch_settings(cur):
+    cur.execute("SELECT key, value FROM settings")
+    return dict(cur.fetchall())
 
 
 def get_settings():
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT key, value FROM settings")
-            rows = cur.fetchall()
-    return resp(200, {'settings': {r['key']: r['value'] for r in rows}})
\ No newline at end of file
+        with conn.cursor() as cur:
+            settings = fetch_settings(cur)
+    return resp(200, {'settings': settings})
+
+
+# ---- Bootstrap ----
+
+BOOTSTRAP_SECTIONS = ('categories', 'products', 'settings', 'banners', 'promotions', 'articles')
+BOOTSTRAP_DEFAULT = ('categories', 'products', 'settings', 'banners', 'promotions')
+
+
+def parse_sections(raw):
+    if not raw or not raw.strip():
+        return BOOTSTRAP_DEFAULT
+    sections = tuple(dict.fromkeys(s.strip() for s in raw.split(',') if s.strip()))
+    if not sections or any(s not in BOOTSTRAP_SECTIONS for s in sections):
+        return None
+    return sections
+
+
+def get_bootstrap(sections, category=None, fields=None):
+    """Все секции главной страницы одним запросом, на одном соединении и одном снимке данных."""
+    data = {}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            data['watermark'] = fetch_watermark(cur)
+            for section in sections:
+                if section == 'products':
+                    data['products'] = fetch_products(cur, {'category': category}, fields)
+                else:
+                    data[section] = BOOTSTRAP_FETCHERS[section](cur)
+    return resp(200, data)
+
+
+BOOTSTRAP_FETCHERS = {
+    'categories': fetch_categories,
+    'settings': fetch_settings,
+    'banners': fetch_banners,
+    'promotions': fetch_promotions,
+    'articles': fetch_articles,
+}
+
+
+# ---- Delta sync ----
+
+# Строка секции, изменённая после since: видимая уходит в upserted, скрытая — в deleted.
+SYNC_QUERIES = {
+    'categories': ('c', """
+        SELECT c.id, c.slug, c.name, c.icon, c.image_url, c.image_variants, c.product_count, c.is_active AS _visible
+        FROM categories c WHERE {changed} ORDER BY c.sort_order, c.id
+    """),
+    'articles': ('a', """
+        SELECT a.id, a.slug, a.title, a.excerpt, a.image_url, a.category, a.read_time, a.created_at,
+               a.is_published AS _visible
+        FROM articles a WHERE {changed} ORDER BY a.sort_order, a.created_at DESC
+    """),
+    'banners': ('b', f"""
+        SELECT {', '.join('b.' + c for c in BANNER_COLUMNS.split(', '))}, b.is_active AS _visible
+        FROM banners b WHERE {{changed}} ORDER BY b.sort_order, b.id
+    """),
+    'promotions': ('pr', f"""
+        SELECT {', '.join('pr.' + c for c in PROMOTION_COLUMNS.split(', '))}, pr.is_active AS _visible
+        FROM promotions pr WHERE {{changed}} ORDER BY pr.sort_order, pr.id
+    """),
+    'settings': ('s', "SELECT s.key, s.value, TRUE AS _visible FROM settings s WHERE {changed}"),
+}
+
+
+def parse_since(raw):
+    """since — водяной знак из прошлого ответа (число) или дата ISO 8601."""
+    raw = (raw or '').strip()
+    if not raw:
+        raise ValueError('since обязателен')
+    if raw.isdigit():
+        return 'version', raw
+    try:
+        return 'timestamp', datetime.fromisoformat(raw.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('since: ожидается версия или дата ISO 8601')
+
+
+def fetch_watermark(cur):
+    # Все транзакции младше xmin снимка уже завершены; более поздние попадут в следующую выборку.
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+    return cur.fetchone()[0]
+
+
+def changed_condition(alias, since):
+    mode, value = since
+    if mode == 'version':
+        return f"{alias}.change_xid >= %s::xid8", value
+    return f"{alias}.updated_at >= %s", value
+
+
+def fetch_changed_rows(cur, section, since, fields):
+    if section == 'products':
+        condition, value = changed_condition('p', since)
+        columns, join = product_columns(fields)
+        cur.execute(f"""
+            SELECT {columns}, p.is_active AS _visible
+            FROM products p
+            {join}
+            WHERE {condition}
+            ORDER BY p.id
+        """, (value,))
+    else:
+        alias, sql = SYNC_QUERIES[section]
+        condition, value = changed_condition(alias, since)
+        cur.execute(sql.format(changed=condition), (value,))
+    return fetch_dicts(cur)
+
+
+def fetch_deletions(cur, sections, since):
+    mode, value = since
+    column = 'change_xid' if mode == 'version' else 'deleted_at'
+    cast = '::xid8' if mode == 'version' else ''
+    cur.execute(f"""
+        SELECT resource, item_key FROM catalog_deletions
+        WHERE {column} >= %s{cast} AND resource = ANY(%s)
+        ORDER BY id
+    """, (value, list(sections)))
+    deleted = {}
+    for resource, item_key in cur.fetchall():
+        deleted.setdefault(resource, []).append(item_key)
+    return deleted
+
+
+def get_changes(sections, since, fields=PRODUCT_LIST_FIELDS):
+    """
+    Изменения секций после since: upserted — новые и изменённые видимые строки,
+    deleted — ключи удалённых и скрытых. watermark передаётся в since следующего запроса.
+    """
+    changes = {}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            watermark = fetch_watermark(cur)
+            deletions = fetch_deletions(cur, sections, since)
+            for section in sections:
+                key = 'key' if section == 'settings' else 'id'
+                upserted, deleted = [], []
+                for row in fetch_changed_rows(cur, section, since, fields):
+                    (upserted if row.pop('_visible') else deleted).append(row)
+                deleted_keys = [row[key] for row in deleted]
+                upserted_keys = {str(row[key]) for row in upserted}
+                for item_key in deletions.get(section, ()):
+                    if item_key not in upserted_keys:
+                        deleted_keys.append(item_key if section == 'settings' else int(item_key))
+                if section == 'settings':
+                    upserted = {row['key']: row['value'] for row in upserted}
+                changes[section] = {'upserted': upserted, 'deleted': deleted_keys}
+    return resp(200, {'watermark': watermark, 'changes': changes})
@@ -1,13 +1,34 @@
 """
 Загрузка изображений товаров и категорий в S3.
-Принимает base64-файл, сохраняет в S3, возвращает CDN URL.
+Принимает файл сырым телом (Content-Type: image/*, папка в ?folder=), multipart/form-data
+или base64 в JSON (старый формат). Сохраняет в S3, возвращает CDN URL.
+?action=presign выдаёт подписанный PUT/POST для загрузки напрямую в бакет,
+?action=confirm проверяет, что объект загружен.
+?action=batch принимает много файлов сразу: проверяет все, затем грузит параллельно и отвечает по каждому.
+Для растровых картинок строит уменьшенные копии в WebP/AVIF и возвращает манифест для srcset.
+Ключ объекта — SHA-256 содержимого: повторная загрузка того же файла не пишет его заново.
 Требует заголовок X-Admin-Key.
 """
+import hashlib
+import io
 import json
 import os
 import base64
+import re
+import threading
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.client import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+except ImportError:
+    Image = None
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -23,6 +44,31 @@ ALLOWED_TYPES = {
     'image/gif': 'gif',
 }
 
+ALLOWED_FOLDERS = ('products', 'categories', 'banners', 'blog', 'promotions')
+
+# Для локального S3-совместимого стенда (MinIO и т.п.) переопределяются endpoint, бакет и публичный URL.
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', '')
+PRESIGN_EXPIRES = int(os.environ.get('PRESIGN_EXPIRES', '600'))
+
+MAX_FILE_BYTES = int(os.environ.get('MAX_FILE_BYTES', str(5 * 1024 * 1024)))
+FILE_TOO_LARGE = f'Файл слишком большой (макс. {MAX_FILE_BYTES // (1024 * 1024)}MB)'
+# Файлы от порога и крупнее уходят в S3 multipart-загрузкой. Порог не выше MAX_FILE_BYTES,
+# иначе multipart недостижим, и не ниже 5MB — минимальный размер части в S3.
+S3_MIN_PART = 5 * 1024 * 1024
+MULTIPART_THRESHOLD = max(min(int(os.environ.get('MULTIPART_THRESHOLD', str(8 * 1024 * 1024))), MAX_FILE_BYTES), S3_MIN_PART)
+MULTIPART_CHUNK = max(int(os.environ.get('MULTIPART_CHUNK', str(MULTIPART_THRESHOLD))), S3_MIN_PART)
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNK,
+    max_concurrency=4,
+)
+# Сколько байт тела декодировать за один шаг чтения.
+READ_CHUNK = 64 * 1024
+MAX_FIELD_BYTES = 1024
+MAX_PART_HEADER_BYTES = 8 * 1024
+
 
 def resp(status, data):
     return {
@@ -32,53 +78,840 @@ def resp(status, data):
     }
 
 
+def get_header(event, name):
+    name = name.lower()
+    for k, v in (event.get('headers') or {}).items():
+        if k.lower() == name:
+            return v
+    return None
+
+
 def handler(event: dict, context) -> dict:
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    key = event.get('headers', {}).get('X-Admin-Key', '')
+    key = get_header(event, 'X-Admin-Key') or ''
     if key != os.environ.get('ADMIN_SECRET_KEY', ''):
         return resp(401, {'error': 'Unauthorized'})
 
     if event.get('httpMethod') != 'POST':
         return resp(405, {'error': 'Method not allowed'})
 
-    body = json.loads(event.get('body') or '{}')
-    file_data = body.get('file')
+    action = (event.get('queryStringParameters') or {}).get('action', 'upload')
+    if action == 'presign':
+        return presign_upload(json.loads(event.get('body') or '{}'))
+    if action == 'confirm':
+        return confirm_upload(json.loads(event.get('body') or '{}'))
+    if action == 'batch':
+        return batch_upload(event)
+    if action != 'upload':
+        return resp(400, {'error': 'action: допустимые значения upload, presign, confirm, batch'})
+
+    params = event.get('queryStringParameters') or {}
+    try:
+        image_bytes, content_type, folder = read_upload(event)
+        check_folder(folder)
+        size = probe_image(image_bytes) if wants_derivatives(params.get('derivatives'), content_type) else None
+        result = store_image(image_bytes, content_type, folder, size)
+    except FileTooLarge:
+        return resp(413, {'error': FILE_TOO_LARGE})
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+
+    return resp(200, result)
+
+
+_s3 = None
+
+
+def s3_client():
+    # Один клиент на инстанс: он потокобезопасен и держит пул соединений между вызовами.
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+            config=Config(
+                signature_version='s3v4',
+                s3={'addressing_style': 'path'},
+                max_pool_connections=max(10, BATCH_WORKERS * TRANSFER_CONFIG.max_concurrency),
+            ),
+        )
+    return _s3
+
+
+def public_url(key):
+    if PUBLIC_BASE_URL:
+        return f"{PUBLIC_BASE_URL.rstrip('/')}/{key}"
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+
+def check_folder(folder):
+    if folder not in ALLOWED_FOLDERS:
+        raise ValueError(f"folder: допустимые значения {', '.join(ALLOWED_FOLDERS)}")
+
+
+def new_key(content_type, folder, digest=None):
+    return f"catalog/{folder}/{digest or uuid.uuid4().hex}.{ALLOWED_TYPES[content_type]}"
+
+
+def store_image(image_bytes, content_type, folder, size=None):
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    filename = new_key(content_type, folder, digest)
+    s3 = s3_client()
+    found = object_exists(s3, filename)
+    # Копии рендерятся до записи оригинала: битый файл не оставит в бакете ничего.
+    manifest = load_manifest(s3, filename) if size and found else None
+    rendered = render_derivatives(image_bytes, size) if size and not manifest else None
+    if not found:
+        s3.upload_fileobj(
+            io.BytesIO(image_bytes),
+            S3_BUCKET,
+            filename,
+            ExtraArgs={'ContentType': content_type, 'CacheControl': IMMUTABLE_CACHE_CONTROL},
+            Config=TRANSFER_CONFIG,
+        )
+        KNOWN_KEYS.add(filename)
+    KNOWN_KEYS.record(found)
+    result = {'url': public_url(filename), 'key': filename, 'sha256': digest, 'deduplicated': bool(found)}
+    if size:
+        result['image_variants'] = manifest or store_derivatives(s3, filename, size, rendered)
+    result['dedup'] = KNOWN_KEYS.snapshot()
+    return result
+
+
+# ---- Content addressing ----
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+KNOWN_KEYS_MAX = int(os.environ.get('KNOWN_KEYS_MAX', '4096'))
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class KnownKeys:
+    """
+    Ключи, которые точно есть в бакете: LRU в памяти тёплого инстанса,
+    чтобы не делать HEAD на каждый повтор. Заодно считает долю дублей.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'uploads': 0, 'hits': 0, 'cache_hits': 0, 'batch_hits': 0}
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def record(self, found):
+        with self._lock:
+            self.stats['uploads'] += 1
+            if found:
+                self.stats['hits'] += 1
+            if found == 'cache':
+                self.stats['cache_hits'] += 1
+            elif found == 'batch':
+                self.stats['batch_hits'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            uploads = self.stats['uploads']
+            return {
+                **self.stats,
+                'hit_rate': round(self.stats['hits'] / uploads, 4) if uploads else 0.0,
+                'known_keys': len(self._keys),
+            }
+
+
+KNOWN_KEYS = KnownKeys(KNOWN_KEYS_MAX)
+
+
+def is_missing(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+def object_exists(s3, key):
+    """'cache' / 'head', если объект уже в бакете, иначе None."""
+    if key in KNOWN_KEYS:
+        return 'cache'
+    try:
+        s3.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if is_missing(e):
+            return None
+        raise
+    KNOWN_KEYS.add(key)
+    return 'head'
+
+
+def manifest_key(key):
+    return f"{key.rsplit('.', 1)[0]}/manifest.json"
+
+
+def load_manifest(s3, key):
+    try:
+        return json.loads(s3.get_object(Bucket=S3_BUCKET, Key=manifest_key(key))['Body'].read())
+    except ClientError as e:
+        if is_missing(e):
+            return None
+        raise
+
+
+# ---- Presigned uploads ----
+
+def presign_upload(body):
+    """
+    Подписанная загрузка в бакет в обход функции. post — policy с content-length-range,
+    put — URL с подписанными Content-Type и Content-Length (размер нужен заранее).
+    """
     content_type = body.get('content_type', 'image/jpeg')
     folder = body.get('folder', 'products')
-
-    if not file_data:
-        return resp(400, {'error': 'file обязателен (base64)'})
+    method = body.get('method', 'post').lower()
+    size = body.get('size')
+    digest = (body.get('sha256') or '').lower() or None
 
     if content_type not in ALLOWED_TYPES:
         return resp(400, {'error': f'Неподдерживаемый тип: {content_type}'})
+    try:
+        check_folder(folder)
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+    if method not in ('post', 'put'):
+        return resp(400, {'error': 'method: допустимые значения post, put'})
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 1):
+        return resp(400, {'error': 'size должен быть положительным числом'})
+    if size is not None and size > MAX_FILE_BYTES:
+        return resp(413, {'error': FILE_TOO_LARGE})
+    if method == 'put' and size is None:
+        return resp(400, {'error': 'Для method=put нужен size'})
+    if digest and not SHA256_RE.match(digest):
+        return resp(400, {'error': 'sha256 должен быть hex-строкой из 64 символов'})
 
-    if ',' in file_data:
-        file_data = file_data.split(',', 1)[1]
+    # С sha256 ключ адресуется содержимым: если такой файл уже есть, загружать нечего.
+    key = new_key(content_type, folder, digest)
+    s3 = s3_client()
+    result = {'key': key, 'url': public_url(key), 'expires_in': PRESIGN_EXPIRES, 'max_bytes': MAX_FILE_BYTES}
+    if digest:
+        found = object_exists(s3, key)
+        KNOWN_KEYS.record(found)
+        result['dedup'] = KNOWN_KEYS.snapshot()
+        if found:
+            return resp(200, {**result, 'exists': True})
+    cache_control = IMMUTABLE_CACHE_CONTROL if digest else None
+    if method == 'put':
+        params = {'Bucket': S3_BUCKET, 'Key': key, 'ContentType': content_type, 'ContentLength': size}
+        headers = {'Content-Type': content_type}
+        if cache_control:
+            params['CacheControl'] = headers['Cache-Control'] = cache_control
+        result['upload'] = {
+            'method': 'PUT',
+            'url': s3.generate_presigned_url('put_object', Params=params, ExpiresIn=PRESIGN_EXPIRES),
+            'headers': headers,
+        }
+    else:
+        fields = {'Content-Type': content_type}
+        if cache_control:
+            fields['Cache-Control'] = cache_control
+        post = s3.generate_presigned_post(
+            S3_BUCKET, key,
+            Fields=fields,
+            Conditions=[{k: v} for k, v in fields.items()] + [['content-length-range', 1, MAX_FILE_BYTES]],
+            ExpiresIn=PRESIGN_EXPIRES,
+        )
+        result['upload'] = {'method': 'POST', 'url': post['url'], 'fields': post['fields']}
+    return resp(200, result)
 
-    image_bytes = base64.b64decode(file_data)
 
-    if len(image_bytes) > 5 * 1024 * 1024:
-        return resp(400, {'error': 'Файл слишком большой (макс. 5MB)'})
+def confirm_upload(body):
+    """Проверяет загруженный по подписи объект; неподходящий удаляется."""
+    key = body.get('key', '')
+    folder = key.split('/')[1] if key.count('/') == 2 and key.startswith('catalog/') else None
+    if folder not in ALLOWED_FOLDERS:
+        return resp(400, {'error': 'Некорректный key'})
 
-    ext = ALLOWED_TYPES[content_type]
-    filename = f"catalog/{folder}/{uuid.uuid4().hex}.{ext}"
+    s3 = s3_client()
+    try:
+        head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if is_missing(e):
+            return resp(404, {'error': 'Файл не загружен'})
+        raise
+
+    content_type = head.get('ContentType', '')
+    size = head.get('ContentLength', 0)
+    expected = key.rsplit('.', 1)[-1]
+    if content_type not in ALLOWED_TYPES or ALLOWED_TYPES[content_type] != expected or size > MAX_FILE_BYTES:
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        return resp(400, {'error': 'Загруженный файл не прошёл проверку и удалён'})
+    result = {'url': public_url(key), 'key': key, 'size': size, 'content_type': content_type}
+    # Для ключа по sha256 проверяем, что содержимое ему соответствует.
+    digest = key.rsplit('/', 1)[-1].split('.')[0]
+    content_addressed = bool(SHA256_RE.match(digest))
+    derivatives = wants_derivatives(body.get('derivatives'), content_type)
+    if content_addressed or derivatives:
+        image_bytes = s3.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read()
+        manifest = rendered = dimensions = None
+        try:
+            if content_addressed and hashlib.sha256(image_bytes).hexdigest() != digest:
+                raise ValueError('sha256 не совпадает')
+            if derivatives:
+                manifest = load_manifest(s3, key) if content_addressed else None
+                if not manifest:
+                    dimensions = probe_image(image_bytes)
+                    rendered = render_derivatives(image_bytes, dimensions)
+        except ValueError:
+            s3.delete_object(Bucket=S3_BUCKET, Key=key)
+            return resp(400, {'error': 'Загруженный файл не прошёл проверку и удалён'})
+        if content_addressed:
+            KNOWN_KEYS.add(key)
+        if derivatives:
+            result['image_variants'] = manifest or store_derivatives(s3, key, dimensions, rendered)
+    return resp(200, result)
+
+
+# ---- Derivatives ----
+
+DERIVATIVE_WIDTHS = tuple(sorted({int(w) for w in os.environ.get('DERIVATIVE_WIDTHS', '200,400,800,1200').split(',') if w.strip()}))
+# Порядок важен: первый формат — предпочтительный источник в <picture>.
+DERIVATIVE_FORMATS = tuple(f.strip() for f in os.environ.get('DERIVATIVE_FORMATS', 'avif,webp').split(',') if f.strip())
+DERIVATIVE_QUALITY = {
+    'webp': int(os.environ.get('WEBP_QUALITY', '80')),
+    'avif': int(os.environ.get('AVIF_QUALITY', '55')),
+}
+DERIVATIVE_MIME = {'webp': 'image/webp', 'avif': 'image/avif'}
+DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', str(os.cpu_count() or 1)))
+# По умолчанию копии строятся при каждой загрузке; ?derivatives=0 отключает.
+DERIVATIVES_DEFAULT = os.environ.get('DERIVATIVES_DEFAULT', '1') == '1'
+DERIVATIVE_CACHE_CONTROL = IMMUTABLE_CACHE_CONTROL
+MAX_IMAGE_PIXELS = 40_000_000
+
+# Анимацию GIF не пережимаем — у копий остался бы только первый кадр.
+DERIVABLE_TYPES = ('image/jpeg', 'image/jpg', 'image/png', 'image/webp')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def wants_derivatives(flag, content_type):
+    if Image is None or content_type not in DERIVABLE_TYPES or not DERIVATIVE_WIDTHS:
+        return False
+    if flag is None or flag == '':
+        return DERIVATIVES_DEFAULT
+    return flag in (True, '1', 'true')
+
+
+def available_formats():
+    return tuple(f for f in DERIVATIVE_FORMATS if f in DERIVATIVE_MIME and features.check(f))
+
+
+def probe_image(image_bytes):
+    """
+    (ширина, высота) с учётом EXIF-поворота. Файл декодируется целиком: обрезанный JPEG
+    с целым заголовком иначе прошёл бы проверку и упал уже при рендере копий.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as im:
+            if im.width * im.height > MAX_IMAGE_PIXELS:
+                raise ValueError('Изображение слишком большое по числу пикселей')
+            im.load()
+            width, height = im.size
+            if im.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise ValueError('Не удалось прочитать изображение')
+    return width, height
+
+
+def target_widths(width):
+    widths = [w for w in DERIVATIVE_WIDTHS if w < width]
+    widths.append(min(width, DERIVATIVE_WIDTHS[-1]))
+    return sorted(set(widths))
+
+
+def render_width(image_bytes, width, formats):
+    """Одна ширина во всех форматах, без EXIF/ICC. Выполняется в процессе пула."""
+    with Image.open(io.BytesIO(image_bytes)) as im:
+        im = ImageOps.exif_transpose(im)
+        has_alpha = im.mode in ('RGBA', 'LA', 'PA') or (im.mode == 'P' and 'transparency' in im.info)
+        im = im.convert('RGBA' if has_alpha else 'RGB')
+        if im.width > width:
+            im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+        im.info = {}
+        encoded = []
+        for fmt in formats:
+            buf = io.BytesIO()
+            options = {'method': 6} if fmt == 'webp' else {}
+            im.save(buf, fmt.upper(), quality=DERIVATIVE_QUALITY[fmt], **options)
+            encoded.append((fmt, buf.getvalue()))
+        return im.width, im.height, encoded
+
+
+def map_in_pool(fn, tasks):
+    """
+    Задачи в пуле процессов; без /dev/shm или при одном воркере — в текущем процессе.
+    В текущий процесс уходим, только если пул не создаётся или сломан (упал воркер);
+    ошибка самой задачи пробрасывается как есть.
+    """
+    global _pool
+    pool = None
+    if DERIVATIVE_WORKERS > 1 and len(tasks) > 1:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    _pool = ProcessPoolExecutor(DERIVATIVE_WORKERS)
+                except (OSError, NotImplementedError):
+                    _pool = None
+            pool = _pool
+    if pool is not None:
+        try:
+            return list(pool.map(fn, *zip(*tasks)))
+        except BrokenProcessPool:
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+    return [fn(*task) for task in tasks]
+
+
+def derivative_key(key, width, fmt):
+    # catalog/products/<id>.jpg -> catalog/products/<id>/w400.webp
+    return f"{key.rsplit('.', 1)[0]}/w{width}.{fmt}"
+
+
+def render_derivatives(image_bytes, size):
+    """(форматы, копии по ширинам) или None, если кодеков нет. Ошибка рендера — ValueError."""
+    formats = available_formats()
+    if not formats:
+        return None
+    try:
+        rendered = map_in_pool(render_width, [(image_bytes, w, formats) for w in target_widths(size[0])])
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ValueError('Не удалось обработать изображение')
+    return formats, rendered
 
-    s3 = boto3.client(
-        's3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
 
+def store_derivatives(s3, key, size, derivatives):
+    """
+    Загружает отрендеренные копии под ключами рядом с оригиналом и манифест:
+    sources — готовые srcset для <source type=...>, variants — каждая копия отдельно.
+    """
+    if not derivatives:
+        return None
+    formats, rendered = derivatives
+
+    variants = []
+    for width, height, encoded in rendered:
+        for fmt, data in encoded:
+            variant_key = derivative_key(key, width, fmt)
+            s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=variant_key,
+                Body=data,
+                ContentType=DERIVATIVE_MIME[fmt],
+                CacheControl=DERIVATIVE_CACHE_CONTROL,
+            )
+            variants.append({
+                'format': fmt, 'width': width, 'height': height,
+                'bytes': len(data), 'url': public_url(variant_key),
+            })
+
+    sources = [
+        {
+            'type': DERIVATIVE_MIME[fmt],
+            'srcset': ', '.join(f"{v['url']} {v['width']}w" for v in variants if v['format'] == fmt),
+        }
+        for fmt in formats
+    ]
+    manifest = {'width': size[0], 'height': size[1], 'sources': sources, 'variants': variants}
     s3.put_object(
-        Bucket='files',
-        Key=filename,
-        Body=image_bytes,
-        ContentType=content_type,
+        Bucket=S3_BUCKET,
+        Key=manifest_key(key),
+        Body=json.dumps(manifest, ensure_ascii=False).encode(),
+        ContentType='application/json',
+        CacheControl=DERIVATIVE_CACHE_CONTROL,
     )
+    return manifest
+
+
+# ---- Batch upload ----
+
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '50'))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', str(64 * 1024 * 1024)))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '8'))
+
+
+def batch_upload(event):
+    """
+    Пакетная загрузка. Сначала проверяются все файлы: если хоть один не годится,
+    в бакет не пишется ничего. Затем файлы грузятся параллельно, ответ — по каждому файлу.
+    """
+    params = event.get('queryStringParameters') or {}
+    try:
+        files = read_batch(event)
+    except FileTooLarge:
+        return resp(413, {'error': f'Пакет слишком большой (макс. {BATCH_MAX_BYTES // (1024 * 1024)}MB)'})
+    except ValueError as e:
+        return resp(400, {'error': str(e)})
+    if not files:
+        return resp(400, {'error': 'Нет файлов для загрузки'})
+
+    flag = params.get('derivatives')
+    for item in files:
+        if 'error' not in item:
+            validate_batch_file(item, flag)
+    invalid = [{'index': f['index'], 'name': f['name'], 'error': f['error']} for f in files if 'error' in f]
+    if invalid:
+        return resp(400, {'error': 'Файлы не прошли проверку, ничего не загружено', 'files': invalid})
+
+    results = upload_batch(files)
+    failed = sum(1 for r in results if 'error' in r)
+    return resp(207 if failed else 200, {
+        'files': results,
+        'uploaded': len(results) - failed,
+        'failed': failed,
+        'dedup': KNOWN_KEYS.snapshot(),
+    })
+
+
+def validate_batch_file(item, flag):
+    try:
+        check_folder(item['folder'])
+        if item['content_type'] not in ALLOWED_TYPES:
+            raise ValueError(f"Неподдерживаемый тип: {item['content_type']}")
+        if not item['bytes']:
+            raise ValueError('Пустой файл')
+        item['size'] = probe_image(item['bytes']) if wants_derivatives(flag, item['content_type']) else None
+        item['sha256'] = hashlib.sha256(item['bytes']).hexdigest()
+    except ValueError as e:
+        item['error'] = str(e)
+
+
+def upload_batch(files):
+    """Загрузка в пуле потоков на общем клиенте; одинаковые файлы пакета уходят в S3 один раз."""
+    s3_client()
+    futures = {}
+    with ThreadPoolExecutor(min(BATCH_WORKERS, len(files))) as pool:
+        for item in files:
+            ident = (item['sha256'], item['content_type'], item['folder'])
+            if ident not in futures:
+                futures[ident] = pool.submit(
+                    store_image, item['bytes'], item['content_type'], item['folder'], item['size'],
+                )
+
+    results = []
+    seen = set()
+    for item in files:
+        entry = {'index': item['index'], 'name': item['name']}
+        ident = (item['sha256'], item['content_type'], item['folder'])
+        try:
+            stored = futures[ident].result()
+        except ValueError as e:
+            entry['error'] = str(e)
+        except (ClientError, BotoCoreError, OSError) as e:
+            entry['error'] = f'Не удалось загрузить: {e}'
+        else:
+            entry.update({k: v for k, v in stored.items() if k != 'dedup'})
+            if ident in seen:
+                # Повтор файла из этого же пакета: в S3 не ходили, это попадание дедупликации.
+                entry['deduplicated'] = True
+                KNOWN_KEYS.record('batch')
+        seen.add(ident)
+        results.append(entry)
+    return results
+
+
+def read_batch(event):
+    """Файлы пакета: multipart с несколькими частями file или JSON {"files": [{"file", "content_type", "name"}]}."""
+    params = event.get('queryStringParameters') or {}
+    media_type, ct_params = parse_header_params(get_header(event, 'Content-Type') or 'application/json')
+    stream = BodyStream(event)
+
+    if media_type == 'multipart/form-data':
+        if not ct_params.get('boundary'):
+            raise ValueError('multipart: не указан boundary')
+        if stream.decoded_size_hint() > BATCH_MAX_BYTES + BATCH_MAX_FILES * MAX_PART_HEADER_BYTES:
+            raise FileTooLarge()
+        return read_multipart_batch(stream, ct_params['boundary'], params)
+
+    if media_type == 'application/json':
+        if stream.decoded_size_hint() > (BATCH_MAX_BYTES * 4 // 3) + 64 * 1024:
+            raise FileTooLarge()
+        return read_json_batch(stream, params)
+
+    raise ValueError('batch: ожидается multipart/form-data или application/json')
+
+
+def batch_file(files, name, content_type, read):
+    """Добавляет файл в пакет; слишком большой файл помечается ошибкой, а не обрывает разбор."""
+    if len(files) >= BATCH_MAX_FILES:
+        raise ValueError(f'Не больше {BATCH_MAX_FILES} файлов за раз')
+    item = {'index': len(files), 'name': name, 'content_type': content_type, 'bytes': b''}
+    try:
+        item['bytes'] = read()
+    except FileTooLarge:
+        item['error'] = FILE_TOO_LARGE
+    except ValueError as e:
+        item['error'] = str(e)
+    files.append(item)
+    if sum(len(f['bytes']) for f in files) > BATCH_MAX_BYTES:
+        raise FileTooLarge()
+    return item
+
+
+def read_multipart_batch(stream, boundary, params):
+    folder = params.get('folder', 'products')
+    files = []
+    for headers, chunks in MultipartParser(stream, boundary).parts():
+        _, disposition = parse_header_params(headers.get('content-disposition', ''))
+        name = disposition.get('name')
+        if name in ('file', 'files'):
+            content_type = (headers.get('content-type') or '').split(';')[0].strip().lower() or 'image/jpeg'
+            batch_file(
+                files, disposition.get('filename'), content_type,
+                lambda: read_limited(chunks, MAX_FILE_BYTES, FileTooLarge()),
+            )
+        elif name == 'folder':
+            folder = read_limited(chunks, MAX_FIELD_BYTES, ValueError('Поле folder слишком длинное')).decode()
+    # Поле folder может идти и после файлов, поэтому проставляем его в конце.
+    for item in files:
+        item['folder'] = folder
+    return files
+
+
+def read_json_batch(stream, params):
+    body = json.loads(read_stream(stream, BATCH_MAX_BYTES * 2) or b'{}')
+    entries = body.get('files')
+    if not isinstance(entries, list):
+        raise ValueError('files обязателен (список)')
+    folder = body.get('folder') or params.get('folder', 'products')
+
+    def decode(data):
+        if ',' in data:
+            data = data.split(',', 1)[1]
+        if len(data) * 3 // 4 - data[-2:].count('=') > MAX_FILE_BYTES:
+            raise FileTooLarge()
+        try:
+            return base64.b64decode(data)
+        except ValueError:
+            raise ValueError('Некорректный base64')
+
+    files = []
+    for entry in entries:
+        entry = entry if isinstance(entry, dict) else {}
+        item = batch_file(
+            files, entry.get('name'), entry.get('content_type', 'image/jpeg'),
+            lambda: decode(entry.get('file') or ''),
+        )
+        item['folder'] = entry.get('folder', folder)
+    return files
+
+
+# ---- Reading the body ----
+
+class FileTooLarge(Exception):
+    pass
+
+
+class BodyStream:
+    """
+    Тело запроса как поток байт. base64 от шлюза декодируется кусками по мере чтения,
+    так что файл сверх лимита отклоняется, не будучи декодирован целиком.
+    """
+
+    def __init__(self, event):
+        self._src = event.get('body') or ''
+        self._base64 = bool(event.get('isBase64Encoded'))
+        self._pos = 0
+
+    def decoded_size_hint(self):
+        if not self._base64:
+            return len(self._src)
+        return len(self._src) * 3 // 4 - self._src[-2:].count('=')
+
+    def read(self, size=READ_CHUNK):
+        if self._pos >= len(self._src):
+            return b''
+        if self._base64:
+            size = -(-size // 3) * 4
+        chunk = self._src[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        if self._base64:
+            try:
+                return base64.b64decode(chunk)
+            except ValueError:
+                raise ValueError('Тело запроса: некорректный base64')
+        return chunk.encode()
+
+
+def read_limited(chunks, limit, error):
+    data = bytearray()
+    for chunk in chunks:
+        data += chunk
+        if len(data) > limit:
+            raise error
+    return bytes(data)
+
+
+def read_stream(stream, limit):
+    def chunks():
+        while True:
+            chunk = stream.read()
+            if not chunk:
+                return
+            yield chunk
+    return read_limited(chunks(), limit, FileTooLarge())
+
+
+class MultipartParser:
+    """Потоковый разбор multipart/form-data: части отдаются кусками, тело целиком не буферизуется."""
+
+    def __init__(self, stream, boundary):
+        self.stream = stream
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        # Первая граница идёт без ведущего CRLF — добавляем его, чтобы искать один разделитель.
+        self.buf = b'\r\n'
+
+    def _fill(self):
+        chunk = self.stream.read()
+        self.buf += chunk
+        return bool(chunk)
+
+    def parts(self):
+        while True:
+            i = self.buf.find(self.delimiter)
+            if i >= 0:
+                self.buf = self.buf[i + len(self.delimiter):]
+                break
+            self.buf = self.buf[-len(self.delimiter):]
+            if not self._fill():
+                raise ValueError('multipart: граница не найдена')
+
+        while True:
+            while len(self.buf) < 2 and self._fill():
+                pass
+            if self.buf.startswith(b'--'):
+                return
+            while b'\r\n\r\n' not in self.buf:
+                if len(self.buf) > MAX_PART_HEADER_BYTES or not self._fill():
+                    raise ValueError('multipart: некорректные заголовки части')
+            head, self.buf = self.buf.split(b'\r\n\r\n', 1)
+            body = self._body()
+            yield parse_part_headers(head), body
+            for _ in body:
+                pass
+
+    def _body(self):
+        keep = len(self.delimiter)
+        while True:
+            i = self.buf.find(self.delimiter)
+            if i >= 0:
+                data, self.buf = self.buf[:i], self.buf[i + keep:]
+                if data:
+                    yield data
+                return
+            if len(self.buf) > keep:
+                data, self.buf = self.buf[:-keep], self.buf[-keep:]
+                yield data
+            if not self._fill():
+                raise ValueError('multipart: неожиданный конец тела')
+
+
+def parse_header_params(value):
+    main, *rest = value.split(';')
+    params = {}
+    for item in rest:
+        if '=' in item:
+            k, v = item.split('=', 1)
+            params[k.strip().lower()] = v.strip().strip('"')
+    return main.strip().lower(), params
+
+
+def parse_part_headers(head):
+    headers = {}
+    for line in head.decode('utf-8', 'replace').split('\r\n'):
+        if ':' in line:
+            k, v = line.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+    return headers
+
+
+def read_upload(event):
+    """Возвращает (байты, content_type, folder) для любого из поддерживаемых форматов тела."""
+    params = event.get('queryStringParameters') or {}
+    media_type, ct_params = parse_header_params(get_header(event, 'Content-Type') or 'application/json')
+    stream = BodyStream(event)
+
+    if media_type == 'application/json':
+        return read_json_upload(stream)
+
+    if media_type == 'multipart/form-data':
+        if not ct_params.get('boundary'):
+            raise ValueError('multipart: не указан boundary')
+        return read_multipart_upload(stream, ct_params['boundary'], params)
+
+    content_type = params.get('content_type') or media_type
+    folder = params.get('folder', 'products')
+    if content_type not in ALLOWED_TYPES:
+        raise ValueError(f'Неподдерживаемый тип: {content_type}')
+    if stream.decoded_size_hint() > MAX_FILE_BYTES:
+        raise FileTooLarge()
+    image_bytes = read_stream(stream, MAX_FILE_BYTES)
+    if not image_bytes:
+        raise ValueError('Пустое тело запроса')
+    return image_bytes, content_type, folder
+
+
+def read_multipart_upload(stream, boundary, params):
+    fields = {'folder': params.get('folder', 'products'), 'content_type': params.get('content_type')}
+    image_bytes, file_type = None, None
+    for headers, chunks in MultipartParser(stream, boundary).parts():
+        _, disposition = parse_header_params(headers.get('content-disposition', ''))
+        name = disposition.get('name')
+        if name == 'file':
+            file_type = (headers.get('content-type') or '').split(';')[0].strip().lower()
+            image_bytes = read_limited(chunks, MAX_FILE_BYTES, FileTooLarge())
+        elif name in fields:
+            fields[name] = read_limited(chunks, MAX_FIELD_BYTES, ValueError(f'Поле {name} слишком длинное')).decode()
+
+    if not image_bytes:
+        raise ValueError('file обязателен')
+    content_type = fields['content_type'] or file_type or 'image/jpeg'
+    if content_type not in ALLOWED_TYPES:
+        raise ValueError(f'Неподдерживаемый тип: {content_type}')
+    return image_bytes, content_type, fields['folder']
+
+
+def read_json_upload(stream):
+    # Старый формат: {"file": "<base64 или data URL>", "content_type", "folder"}.
+    if stream.decoded_size_hint() > (MAX_FILE_BYTES * 4 // 3) + 64 * 1024:
+        raise FileTooLarge()
+    body = json.loads(read_stream(stream, MAX_FILE_BYTES * 2) or b'{}')
+    file_data = body.get('file')
+    content_type = body.get('content_type', 'image/jpeg')
+    folder = body.get('folder', 'products')
+
+    if not file_data:
+        raise ValueError('file обязателен (base64)')
+
+    if content_type not in ALLOWED_TYPES:
+        raise ValueError(f'Неподдерживаемый тип: {content_type}')
+
+    if ',' in file_data:
+        file_data = file_data.split(',', 1)[1]
 
-    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{filename}"
+    if len(file_data) * 3 // 4 - file_data[-2:].count('=') > MAX_FILE_BYTES:
+        raise FileTooLarge()
 
-    return resp(200, {'url': cdn_url})
\ No newline at end of file
+    return base64.b64decode(file_data), content_type, folder
@@ -0,0 +1,119 @@
+"""
+Микробенчмарк сериализации списка товаров: текущий путь (RealDictCursor + dict(r) +
+json.dumps(default=str)) против кортежей с описанием колонок и сборки JSON в Postgres.
+
+    python bench/catalog_public_serialize.py          # синтетические строки, 10k и 100k товаров
+    python bench/catalog_public_serialize.py --live   # дополнительно реальная база из DATABASE_URL
+
+Лежит вне backend/, чтобы не попадать в сборку функции; index импортируется из backend/catalog-public.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'catalog-public'))
+
+import index
+
+
+COLUMNS = ['id', 'name', 'category_slug', 'price', 'description', 'image_url',
+           'in_stock', 'sku', 'specifications', 'category_name']
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.description = [(name,) for name in COLUMNS]
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+
+def make_rows(n, as_text):
+    rows = []
+    for i in range(n):
+        price = f'{i % 5000}.50' if as_text else Decimal(f'{i % 5000}.50')
+        rows.append((
+            i,
+            f'Пуговица металлическая №{i}',
+            f'category-{i % 20}',
+            price,
+            'Фурнитура для верхней одежды, покрытие никель, упаковка 100 шт.',
+            f'https://cdn.poehali.dev/catalog/products/{i}.jpg',
+            i % 7 != 0,
+            f'SKU-{i:06d}',
+            {'Материал': 'металл', 'Диаметр': f'{10 + i % 15} мм', 'Цвет': 'серебро'},
+            f'Категория {i % 20}',
+        ))
+    return rows
+
+
+def bench(fn, repeat):
+    best = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return best, len(body.encode())
+
+
+class RealDictRow(dict):
+    """Как в psycopg2.extras: RealDictCursor собирает подкласс dict на каждую строку."""
+
+
+def run_synthetic(n, repeat):
+    native_rows = make_rows(n, as_text=False)
+    tuple_rows = make_rows(n, as_text=True)
+
+    def current():
+        fetched = [RealDictRow(zip(COLUMNS, r)) for r in native_rows]
+        rows = [dict(r) for r in fetched]
+        return json.dumps({'products': rows}, ensure_ascii=False, default=str)
+
+    def tuples():
+        rows = index.fetch_dicts(FakeCursor(tuple_rows))
+        return index.resp(200, {'products': rows})['body']
+
+    for name, fn in (('RealDictCursor + default=str', current), ('tuples + text numeric', tuples)):
+        elapsed, size = bench(fn, repeat)
+        print(f'{n:>7} | {name:<30} | {elapsed * 1000:9.1f} ms | {size / 1024:9.0f} KB')
+
+
+def run_live(repeat):
+    serializers = ('python', 'postgres')
+    for serializer in serializers:
+        index.PRODUCTS_SERIALIZER = serializer
+        elapsed, size = bench(lambda: index.get_products(fields=tuple(index.PRODUCT_FIELDS))['body'], repeat)
+        print(f'   live | {serializer:<30} | {elapsed * 1000:9.1f} ms | {size / 1024:9.0f} KB')
+    print('pool:', index.POOL.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--live', action='store_true')
+    args = parser.parse_args()
+
+    print('   rows | path                           |         time |         body')
+    for n in (int(s) for s in args.sizes.split(',')):
+        run_synthetic(n, args.repeat)
+
+    if args.live:
+        if 'DATABASE_URL' not in os.environ:
+            sys.exit('--live требует DATABASE_URL')
+        run_live(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+CREATE TABLE IF NOT EXISTS catalog_versions (
+  resource VARCHAR(50) PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 1,
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO catalog_versions (resource) VALUES
+  ('categories'),
+  ('products'),
+  ('articles'),
+  ('banners'),
+  ('promotions'),
+  ('settings')
+ON CONFLICT (resource) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+  UPDATE catalog_versions
+  SET version = version + 1, updated_at = NOW()
+  WHERE resource = TG_ARGV[0];
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_categories_version ON categories;
+CREATE TRIGGER trg_categories_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('categories');
+
+DROP TRIGGER IF EXISTS trg_products_version ON products;
+CREATE TRIGGER trg_products_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('products');
+
+DROP TRIGGER IF EXISTS trg_articles_version ON articles;
+CREATE TRIGGER trg_articles_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON articles
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('articles');
+
+DROP TRIGGER IF EXISTS trg_banners_version ON banners;
+CREATE TRIGGER trg_banners_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON banners
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('banners');
+
+DROP TRIGGER IF EXISTS trg_promotions_version ON promotions;
+CREATE TRIGGER trg_promotions_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON promotions
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('promotions');
+
+DROP TRIGGER IF EXISTS trg_settings_version ON settings;
+CREATE TRIGGER trg_settings_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON settings
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('settings');
@@ -0,0 +1,6 @@
+UPDATE products SET sort_order = 0 WHERE sort_order IS NULL;
+ALTER TABLE products ALTER COLUMN sort_order SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_products_active_order
+  ON products(category_slug, sort_order, id)
+  WHERE is_active = TRUE;
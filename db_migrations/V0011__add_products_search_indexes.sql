@@ -0,0 +1,11 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN ((
+    setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(sku, '')), 'A') ||
+    setweight(jsonb_to_tsvector('russian', coalesce(specifications, '{}'::jsonb), '["string"]'), 'B') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'C')
+));
+
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING GIN (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_products_sku_trgm ON products USING GIN (sku gin_trgm_ops);
@@ -0,0 +1,59 @@
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS product_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION maintain_category_product_count() RETURNS trigger AS $$
+BEGIN
+  -- Переименование категории каскадом меняет category_slug у товаров (ON UPDATE CASCADE).
+  -- Счётчик уже лежит в строке категории под новым slug, пересчитывать нечего.
+  IF TG_OP = 'UPDATE' AND pg_trigger_depth() > 1
+     AND OLD.is_active IS NOT DISTINCT FROM NEW.is_active THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_active AND OLD.category_slug IS NOT NULL THEN
+    IF TG_OP = 'DELETE' OR NOT (NEW.is_active AND NEW.category_slug IS NOT DISTINCT FROM OLD.category_slug) THEN
+      UPDATE categories SET product_count = product_count - 1 WHERE slug = OLD.category_slug;
+    END IF;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_active AND NEW.category_slug IS NOT NULL THEN
+    IF TG_OP = 'INSERT' OR NOT (OLD.is_active AND OLD.category_slug IS NOT DISTINCT FROM NEW.category_slug) THEN
+      UPDATE categories SET product_count = product_count + 1 WHERE slug = NEW.category_slug;
+    END IF;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_category_count ON products;
+CREATE TRIGGER trg_products_category_count
+  AFTER INSERT OR UPDATE OF category_slug, is_active OR DELETE ON products
+  FOR EACH ROW EXECUTE FUNCTION maintain_category_product_count();
+
+-- Сверка счётчиков с фактическим числом активных товаров. Возвращает исправленные строки.
+CREATE OR REPLACE FUNCTION reconcile_category_product_counts()
+RETURNS TABLE (slug VARCHAR, old_count INTEGER, new_count INTEGER) AS $$
+BEGIN
+  RETURN QUERY
+  WITH actual AS (
+    SELECT c.id, COUNT(p.id)::INTEGER AS cnt
+    FROM categories c
+    LEFT JOIN products p ON p.category_slug = c.slug AND p.is_active = TRUE
+    GROUP BY c.id
+  ),
+  drifted AS (
+    SELECT c.id, c.product_count AS old_count, a.cnt AS new_count
+    FROM categories c
+    JOIN actual a ON a.id = c.id
+    WHERE c.product_count <> a.cnt
+    FOR UPDATE OF c
+  )
+  UPDATE categories c
+  SET product_count = d.new_count
+  FROM drifted d
+  WHERE c.id = d.id
+  RETURNING c.slug, d.old_count, d.new_count;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT * FROM reconcile_category_product_counts();
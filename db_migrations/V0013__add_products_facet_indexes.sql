@@ -0,0 +1,7 @@
+CREATE INDEX IF NOT EXISTS idx_products_specs
+  ON products USING GIN (specifications jsonb_path_ops)
+  WHERE is_active = TRUE;
+
+CREATE INDEX IF NOT EXISTS idx_products_active_category_price
+  ON products(category_slug, price)
+  WHERE is_active = TRUE;
@@ -0,0 +1,16 @@
+-- Каждое изменение таблицы каталога, помимо увеличения версии, шлёт NOTIFY catalog_changes
+-- с полезной нагрузкой "<ресурс>:<версия>". NOTIFY транзакционный: слушатели получат его
+-- только после COMMIT, вместе с изменениями.
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+DECLARE
+  new_version BIGINT;
+BEGIN
+  UPDATE catalog_versions
+  SET version = version + 1, updated_at = NOW()
+  WHERE resource = TG_ARGV[0]
+  RETURNING version INTO new_version;
+
+  PERFORM pg_notify('catalog_changes', TG_ARGV[0] || ':' || COALESCE(new_version, 0));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
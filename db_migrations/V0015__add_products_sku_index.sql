@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_products_sku ON products(sku);
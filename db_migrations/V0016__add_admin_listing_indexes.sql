@@ -0,0 +1,10 @@
+CREATE INDEX IF NOT EXISTS idx_products_admin_position
+  ON products((COALESCE(category_slug, '')), sort_order, id);
+
+CREATE INDEX IF NOT EXISTS idx_products_admin_updated
+  ON products((COALESCE(updated_at, 'epoch')), id);
+
+CREATE INDEX IF NOT EXISTS idx_products_admin_price
+  ON products(price, id);
+
+CREATE INDEX IF NOT EXISTS idx_articles_title_trgm ON articles USING GIN (title gin_trgm_ops);
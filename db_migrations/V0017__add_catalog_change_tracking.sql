@@ -0,0 +1,111 @@
+-- Дельта-синхронизация (catalog-public ?resource=changes&since=).
+-- change_xid — номер транзакции, последней менявшей строку. Водяной знак отдаётся как
+-- pg_snapshot_xmin снимка, на котором читались данные: все транзакции с меньшим номером
+-- уже завершены, поэтому выборка «change_xid >= знак» не теряет изменения, закоммиченные
+-- после чтения, а лишь иногда присылает строку повторно.
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+ALTER TABLE banners ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+ALTER TABLE promotions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE products ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE articles ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE banners ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE promotions ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE settings ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX IF NOT EXISTS idx_categories_change_xid ON categories(change_xid);
+CREATE INDEX IF NOT EXISTS idx_products_change_xid ON products(change_xid);
+CREATE INDEX IF NOT EXISTS idx_articles_change_xid ON articles(change_xid);
+CREATE INDEX IF NOT EXISTS idx_banners_change_xid ON banners(change_xid);
+CREATE INDEX IF NOT EXISTS idx_promotions_change_xid ON promotions(change_xid);
+CREATE INDEX IF NOT EXISTS idx_settings_change_xid ON settings(change_xid);
+
+-- updated_at и change_xid ставит база, а не каждый UPDATE в коде функций.
+CREATE OR REPLACE FUNCTION touch_catalog_row() RETURNS trigger AS $$
+BEGIN
+  NEW.updated_at := NOW();
+  NEW.change_xid := pg_current_xact_id();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_categories_touch ON categories;
+CREATE TRIGGER trg_categories_touch
+  BEFORE UPDATE ON categories
+  FOR EACH ROW EXECUTE FUNCTION touch_catalog_row();
+
+DROP TRIGGER IF EXISTS trg_products_touch ON products;
+CREATE TRIGGER trg_products_touch
+  BEFORE UPDATE ON products
+  FOR EACH ROW EXECUTE FUNCTION touch_catalog_row();
+
+DROP TRIGGER IF EXISTS trg_articles_touch ON articles;
+CREATE TRIGGER trg_articles_touch
+  BEFORE UPDATE ON articles
+  FOR EACH ROW EXECUTE FUNCTION touch_catalog_row();
+
+DROP TRIGGER IF EXISTS trg_banners_touch ON banners;
+CREATE TRIGGER trg_banners_touch
+  BEFORE UPDATE ON banners
+  FOR EACH ROW EXECUTE FUNCTION touch_catalog_row();
+
+DROP TRIGGER IF EXISTS trg_promotions_touch ON promotions;
+CREATE TRIGGER trg_promotions_touch
+  BEFORE UPDATE ON promotions
+  FOR EACH ROW EXECUTE FUNCTION touch_catalog_row();
+
+DROP TRIGGER IF EXISTS trg_settings_touch ON settings;
+CREATE TRIGGER trg_settings_touch
+  BEFORE UPDATE ON settings
+  FOR EACH ROW EXECUTE FUNCTION touch_catalog_row();
+
+-- Журнал удалений: клиент получает по нему tombstone-ы.
+CREATE TABLE IF NOT EXISTS catalog_deletions (
+  id BIGSERIAL PRIMARY KEY,
+  resource VARCHAR(50) NOT NULL,
+  item_key TEXT NOT NULL,
+  change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+  deleted_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_deletions_change_xid ON catalog_deletions(change_xid);
+CREATE INDEX IF NOT EXISTS idx_catalog_deletions_deleted_at ON catalog_deletions(deleted_at);
+
+CREATE OR REPLACE FUNCTION log_catalog_deletion() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO catalog_deletions (resource, item_key)
+  VALUES (TG_ARGV[0], to_jsonb(OLD) ->> TG_ARGV[1]);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_categories_deletions ON categories;
+CREATE TRIGGER trg_categories_deletions
+  AFTER DELETE ON categories
+  FOR EACH ROW EXECUTE FUNCTION log_catalog_deletion('categories', 'id');
+
+DROP TRIGGER IF EXISTS trg_products_deletions ON products;
+CREATE TRIGGER trg_products_deletions
+  AFTER DELETE ON products
+  FOR EACH ROW EXECUTE FUNCTION log_catalog_deletion('products', 'id');
+
+DROP TRIGGER IF EXISTS trg_articles_deletions ON articles;
+CREATE TRIGGER trg_articles_deletions
+  AFTER DELETE ON articles
+  FOR EACH ROW EXECUTE FUNCTION log_catalog_deletion('articles', 'id');
+
+DROP TRIGGER IF EXISTS trg_banners_deletions ON banners;
+CREATE TRIGGER trg_banners_deletions
+  AFTER DELETE ON banners
+  FOR EACH ROW EXECUTE FUNCTION log_catalog_deletion('banners', 'id');
+
+DROP TRIGGER IF EXISTS trg_promotions_deletions ON promotions;
+CREATE TRIGGER trg_promotions_deletions
+  AFTER DELETE ON promotions
+  FOR EACH ROW EXECUTE FUNCTION log_catalog_deletion('promotions', 'id');
+
+DROP TRIGGER IF EXISTS trg_settings_deletions ON settings;
+CREATE TRIGGER trg_settings_deletions
+  AFTER DELETE ON settings
+  FOR EACH ROW EXECUTE FUNCTION log_catalog_deletion('settings', 'key');
@@ -0,0 +1,30 @@
+-- Манифест уменьшенных копий картинки от upload-image (sources для srcset, variants).
+ALTER TABLE products ADD COLUMN IF NOT EXISTS image_variants JSONB;
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS image_variants JSONB;
+ALTER TABLE banners ADD COLUMN IF NOT EXISTS image_variants JSONB;
+
+-- Сменили image_url, не передав новые копии, — старые относятся к другой картинке.
+CREATE OR REPLACE FUNCTION reset_stale_image_variants() RETURNS trigger AS $$
+BEGIN
+  IF NEW.image_url IS DISTINCT FROM OLD.image_url
+     AND NEW.image_variants IS NOT DISTINCT FROM OLD.image_variants THEN
+    NEW.image_variants := NULL;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_image_variants ON products;
+CREATE TRIGGER trg_products_image_variants
+  BEFORE UPDATE OF image_url ON products
+  FOR EACH ROW EXECUTE FUNCTION reset_stale_image_variants();
+
+DROP TRIGGER IF EXISTS trg_categories_image_variants ON categories;
+CREATE TRIGGER trg_categories_image_variants
+  BEFORE UPDATE OF image_url ON categories
+  FOR EACH ROW EXECUTE FUNCTION reset_stale_image_variants();
+
+DROP TRIGGER IF EXISTS trg_banners_image_variants ON banners;
+CREATE TRIGGER trg_banners_image_variants
+  BEFORE UPDATE OF image_url ON banners
+  FOR EACH ROW EXECUTE FUNCTION reset_stale_image_variants();
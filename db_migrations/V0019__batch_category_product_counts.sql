@@ -0,0 +1,93 @@
+-- Счётчик product_count ведётся одним UPDATE categories на оператор, а не на каждую строку:
+-- массовый импорт или переключение тысяч товаров больше не порождает тысячи обновлений
+-- категорий, версий каталога и NOTIFY. Изменения берутся из переходных таблиц оператора
+-- и суммируются по slug.
+CREATE OR REPLACE FUNCTION maintain_category_product_counts() RETURNS trigger AS $$
+DECLARE
+  slugs VARCHAR[];
+  deltas INTEGER[];
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(category_slug), array_agg(cnt) INTO slugs, deltas
+    FROM (
+      SELECT category_slug, COUNT(*)::INTEGER AS cnt
+      FROM new_rows
+      WHERE is_active AND category_slug IS NOT NULL
+      GROUP BY category_slug
+    ) d;
+
+  ELSIF TG_OP = 'DELETE' THEN
+    SELECT array_agg(category_slug), array_agg(-cnt) INTO slugs, deltas
+    FROM (
+      SELECT category_slug, COUNT(*)::INTEGER AS cnt
+      FROM old_rows
+      WHERE is_active AND category_slug IS NOT NULL
+      GROUP BY category_slug
+    ) d;
+
+  ELSE
+    -- Переименование категории каскадом меняет category_slug у товаров (ON UPDATE CASCADE)
+    -- вложенным оператором. Счётчик уже лежит в строке категории под новым slug,
+    -- поэтому на глубине > 1 учитываются только строки, у которых поменялся is_active.
+    WITH pairs AS (
+      SELECT o.category_slug AS old_slug, o.is_active AS old_active,
+             n.category_slug AS new_slug, n.is_active AS new_active
+      FROM old_rows o
+      JOIN new_rows n ON n.id = o.id
+      WHERE pg_trigger_depth() = 1 OR o.is_active IS DISTINCT FROM n.is_active
+    ),
+    moves AS (
+      SELECT old_slug AS slug, -1 AS delta FROM pairs
+      WHERE old_active AND old_slug IS NOT NULL
+        AND NOT (new_active AND new_slug IS NOT DISTINCT FROM old_slug)
+      UNION ALL
+      SELECT new_slug, 1 FROM pairs
+      WHERE new_active AND new_slug IS NOT NULL
+        AND NOT (old_active AND old_slug IS NOT DISTINCT FROM new_slug)
+    )
+    SELECT array_agg(slug), array_agg(delta) INTO slugs, deltas
+    FROM (
+      SELECT slug, SUM(delta)::INTEGER AS delta
+      FROM moves
+      GROUP BY slug
+      HAVING SUM(delta) <> 0
+    ) d;
+  END IF;
+
+  -- Пустой UPDATE тоже запустил бы statement-триггеры categories (версия, NOTIFY).
+  IF slugs IS NOT NULL THEN
+    UPDATE categories c
+    SET product_count = c.product_count + d.delta
+    FROM unnest(slugs, deltas) AS d(slug, delta)
+    WHERE c.slug = d.slug;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_category_count ON products;
+
+-- Переходные таблицы нельзя объявить у триггера на несколько событий и у UPDATE OF <колонки>,
+-- поэтому три триггера на одну функцию; UPDATE-триггер срабатывает на любой UPDATE товаров.
+DROP TRIGGER IF EXISTS trg_products_category_count_insert ON products;
+CREATE TRIGGER trg_products_category_count_insert
+  AFTER INSERT ON products
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION maintain_category_product_counts();
+
+DROP TRIGGER IF EXISTS trg_products_category_count_update ON products;
+CREATE TRIGGER trg_products_category_count_update
+  AFTER UPDATE ON products
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION maintain_category_product_counts();
+
+DROP TRIGGER IF EXISTS trg_products_category_count_delete ON products;
+CREATE TRIGGER trg_products_category_count_delete
+  AFTER DELETE ON products
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION maintain_category_product_counts();
+
+DROP FUNCTION IF EXISTS maintain_category_product_count();
+
+SELECT * FROM reconcile_category_product_counts();
@@ -0,0 +1,13 @@
+-- Полезная нагрузка NOTIFY — только имя таблицы. Одинаковые уведомления в одной транзакции
+-- Postgres схлопывает в одно, а с "<ресурс>:<версия>" каждое было уникальным. Слушателю
+-- версия не нужна: по имени таблицы он сбрасывает кэш, а версии перечитывает сам.
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+  UPDATE catalog_versions
+  SET version = version + 1, updated_at = NOW()
+  WHERE resource = TG_ARGV[0];
+
+  PERFORM pg_notify('catalog_changes', TG_ARGV[0]);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
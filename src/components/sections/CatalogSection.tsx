@@ -39,8 +39,8 @@ interface ApiProduct {
   image_url: string | null;
   in_stock: boolean;
   sku: string | null;
-  description: string | null;
-  specifications: Record<string, string> | null;
+  description?: string | null;
+  specifications?: Record<string, string> | null;
 }
 
 interface CatalogSectionProps {
@@ -60,14 +60,14 @@ export default function CatalogSection({ initialCategory = 'all' }: CatalogSecti
   const [apiLoaded, setApiLoaded] = useState(false);
 
   useEffect(() => {
-    Promise.all([
-      fetch(`${CATALOG_URL}?resource=categories`).then(r => r.json()),
-      fetch(`${CATALOG_URL}?resource=products`).then(r => r.json()),
-    ]).then(([catData, prodData]) => {
-      if (catData.categories?.length) setApiCategories(catData.categories);
-      if (prodData.products?.length) setApiProducts(prodData.products);
-      setApiLoaded(true);
-    }).catch(() => setApiLoaded(true));
+    fetch(`${CATALOG_URL}?resource=bootstrap&sections=categories,products`)
+      .then(r => r.json())
+      .then(data => {
+        if (data.categories?.length) setApiCategories(data.categories);
+        if (data.products?.length) setApiProducts(data.products);
+        setApiLoaded(true);
+      })
+      .catch(() => setApiLoaded(true));
   }, []);
 
   const toProduct = (p: ApiProduct): Product => ({
@@ -82,6 +82,20 @@ export default function CatalogSection({ initialCategory = 'all' }: CatalogSecti
     specifications: p.specifications,
   });
 
+  const openProduct = (product: Product) => {
+    setSelectedProduct(product);
+    setIsModalOpen(true);
+    fetch(`${CATALOG_URL}?resource=product&id=${product.id}`)
+      .then(r => r.json())
+      .then(data => {
+        if (!data.product) return;
+        setSelectedProduct(prev => prev && prev.id === product.id
+          ? { ...prev, description: data.product.description, specifications: data.product.specifications }
+          : prev);
+      })
+      .catch(() => {});
+  };
+
   const categories = apiLoaded
     ? [{ id: 'all', name: 'Все', icon: 'Package' }, ...apiCategories.map(c => ({ id: c.slug, name: c.name, icon: c.icon || 'Package' }))]
     : [];
@@ -211,10 +225,7 @@ export default function CatalogSection({ initialCategory = 'all' }: CatalogSecti
                 key={product.id} 
                 className="fade-on-scroll overflow-hidden group hover:shadow-xl transition-all duration-300 cursor-pointer" 
                 style={{ animationDelay: `${idx * 100}ms` }}
-                onClick={() => {
-                  setSelectedProduct(product);
-                  setIsModalOpen(true);
-                }}
+                onClick={() => openProduct(product)}
               >
                 <div className="aspect-square overflow-hidden bg-secondary">
                   <img 
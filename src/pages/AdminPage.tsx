@@ -2,7 +2,7 @@ import { useState, useEffect } from 'react';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import { toast } from 'sonner';
-import { ADMIN_URL, UPLOAD_URL, Category, Product } from './admin/types';
+import { ADMIN_URL, UPLOAD_URL, Category, Product, UploadedImage } from './admin/types';
 import AdminLogin from './admin/AdminLogin';
 import CategoryPanel from './admin/CategoryPanel';
 import ProductPanel from './admin/ProductPanel';
@@ -33,27 +33,22 @@ export default function AdminPage() {
     return res.json();
   };
 
-  const uploadImage = async (file: File, folder: string): Promise<string | null> => {
-    return new Promise((resolve) => {
-      const reader = new FileReader();
-      reader.onload = async (e) => {
-        const base64 = (e.target?.result as string) ?? '';
-        try {
-          const res = await fetch(UPLOAD_URL, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json', 'X-Admin-Key': adminKey },
-            body: JSON.stringify({ file: base64, content_type: file.type, folder }),
-          });
-          const data = await res.json();
-          if (data.url) { resolve(data.url); }
-          else { toast.error(data.error || 'Ошибка загрузки'); resolve(null); }
-        } catch {
-          toast.error('Ошибка загрузки');
-          resolve(null);
-        }
-      };
-      reader.readAsDataURL(file);
-    });
+  const uploadImage = async (file: File, folder: string): Promise<UploadedImage | null> => {
+    try {
+      const params = new URLSearchParams({ folder });
+      const res = await fetch(`${UPLOAD_URL}?${params}`, {
+        method: 'POST',
+        headers: { 'Content-Type': file.type, 'X-Admin-Key': adminKey },
+        body: file,
+      });
+      const data = await res.json();
+      if (data.url) return { url: data.url, image_variants: data.image_variants || null };
+      toast.error(data.error || 'Ошибка загрузки');
+      return null;
+    } catch {
+      toast.error('Ошибка загрузки');
+      return null;
+    }
   };
 
   const login = async () => {
@@ -7,13 +7,14 @@ import { Textarea } from '@/components/ui/textarea';
 import Icon from '@/components/ui/icon';
 import ImageUploader from '@/components/ui/image-uploader';
 import { toast } from 'sonner';
-import { ApiCall, UploadImage } from './types';
+import { ApiCall, UploadImage, ImageVariants } from './types';
 
 export interface Banner {
   id: number;
   title: string;
   description: string | null;
   image_url: string | null;
+  image_variants: ImageVariants | null;
   badge: string;
   button_text: string;
   button_url: string;
@@ -40,7 +41,7 @@ const GRADIENTS = [
 ];
 
 const EMPTY_FORM = {
-  title: '', description: '', image_url: '', badge: 'Новость',
+  title: '', description: '', image_url: '', image_variants: null as ImageVariants | null, badge: 'Новость',
   button_text: 'Подробнее', button_url: '/catalog',
   gradient: 'from-secondary/95 to-muted/90', is_active: true, sort_order: 0,
 };
@@ -56,6 +57,7 @@ export default function BannersPanel({ banners, loading, apiCall, uploadImage, o
       title: ban.title,
       description: ban.description || '',
       image_url: ban.image_url || '',
+      image_variants: ban.image_variants,
       badge: ban.badge,
       button_text: ban.button_text,
       button_url: ban.button_url,
@@ -143,13 +145,14 @@ export default function BannersPanel({ banners, loading, apiCall, uploadImage, o
               <Label>Изображение</Label>
               <ImageUploader
                 value={form.image_url}
-                onChange={url => setForm(f => ({ ...f, image_url: url }))}
+                onChange={url => setForm(f => ({ ...f, image_url: url, image_variants: url === f.image_url ? f.image_variants : null }))}
                 uploading={uploading}
                 onUpload={async (file) => {
                   setUploading(true);
-                  const url = await uploadImage(file, 'banners');
+                  const uploaded = await uploadImage(file, 'banners');
                   setUploading(false);
-                  return url;
+                  if (uploaded) setForm(f => ({ ...f, image_url: uploaded.url, image_variants: uploaded.image_variants }));
+                  return uploaded?.url ?? null;
                 }}
               />
             </div>
@@ -227,9 +227,9 @@ export default function BlogPanel({ articles, loading, apiCall, uploadImage, onR
                 uploading={uploading}
                 onUpload={async (file) => {
                   setUploading(true);
-                  const url = await uploadImage(file, 'blog');
+                  const uploaded = await uploadImage(file, 'blog');
                   setUploading(false);
-                  return url;
+                  return uploaded?.url ?? null;
                 }}
               />
             </div>
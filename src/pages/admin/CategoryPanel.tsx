@@ -7,7 +7,7 @@ import { Badge } from '@/components/ui/badge';
 import Icon from '@/components/ui/icon';
 import ImageUploader from '@/components/ui/image-uploader';
 import { toast } from 'sonner';
-import { Category, ApiCall, UploadImage } from './types';
+import { Category, ApiCall, UploadImage, ImageVariants } from './types';
 
 interface CategoryPanelProps {
   categories: Category[];
@@ -18,7 +18,7 @@ interface CategoryPanelProps {
   onEditStart: (cat: Category) => void;
 }
 
-const EMPTY_FORM = { slug: '', name: '', icon: 'Package', image_url: '', sort_order: 0 };
+const EMPTY_FORM = { slug: '', name: '', icon: 'Package', image_url: '', image_variants: null as ImageVariants | null, sort_order: 0 };
 
 export default function CategoryPanel({ categories, loading, apiCall, uploadImage, onReload, onEditStart }: CategoryPanelProps) {
   const [form, setForm] = useState(EMPTY_FORM);
@@ -27,7 +27,7 @@ export default function CategoryPanel({ categories, loading, apiCall, uploadImag
 
   const startEdit = (cat: Category) => {
     setEditCat(cat);
-    setForm({ slug: cat.slug, name: cat.name, icon: cat.icon || 'Package', image_url: cat.image_url || '', sort_order: cat.sort_order });
+    setForm({ slug: cat.slug, name: cat.name, icon: cat.icon || 'Package', image_url: cat.image_url || '', image_variants: cat.image_variants, sort_order: cat.sort_order });
     onEditStart(cat);
   };
 
@@ -82,13 +82,14 @@ export default function CategoryPanel({ categories, loading, apiCall, uploadImag
             <Label>Изображение</Label>
             <ImageUploader
               value={form.image_url}
-              onChange={url => setForm(f => ({ ...f, image_url: url }))}
+              onChange={url => setForm(f => ({ ...f, image_url: url, image_variants: url === f.image_url ? f.image_variants : null }))}
               uploading={uploading}
               onUpload={async (file) => {
                 setUploading(true);
-                const url = await uploadImage(file, 'categories');
+                const uploaded = await uploadImage(file, 'categories');
                 setUploading(false);
-                return url;
+                if (uploaded) setForm(f => ({ ...f, image_url: uploaded.url, image_variants: uploaded.image_variants }));
+                return uploaded?.url ?? null;
               }}
             />
           </div>
@@ -8,7 +8,7 @@ import { Badge } from '@/components/ui/badge';
 import Icon from '@/components/ui/icon';
 import ImageUploader from '@/components/ui/image-uploader';
 import { toast } from 'sonner';
-import { Category, Product, ApiCall, UploadImage } from './types';
+import { Category, Product, ApiCall, UploadImage, ImageVariants } from './types';
 
 interface ProductPanelProps {
   products: Product[];
@@ -20,7 +20,7 @@ interface ProductPanelProps {
   onEditStart: (prod: Product) => void;
 }
 
-const EMPTY_FORM = { name: '', category_slug: '', price: '', description: '', image_url: '', in_stock: true, sort_order: 0, sku: '', specifications: '' };
+const EMPTY_FORM = { name: '', category_slug: '', price: '', description: '', image_url: '', image_variants: null as ImageVariants | null, in_stock: true, sort_order: 0, sku: '', specifications: '' };
 
 function specsToText(specs: Record<string, string> | null | undefined): string {
   if (!specs || typeof specs !== 'object') return '';
@@ -53,6 +53,7 @@ export default function ProductPanel({ products, categories, loading, apiCall, u
       price: String(prod.price),
       description: prod.description || '',
       image_url: prod.image_url || '',
+      image_variants: prod.image_variants,
       in_stock: prod.in_stock,
       sort_order: prod.sort_order,
       sku: prod.sku || '',
@@ -141,13 +142,14 @@ export default function ProductPanel({ products, categories, loading, apiCall, u
             <Label>Изображение</Label>
             <ImageUploader
               value={form.image_url}
-              onChange={url => setForm(f => ({ ...f, image_url: url }))}
+              onChange={url => setForm(f => ({ ...f, image_url: url, image_variants: url === f.image_url ? f.image_variants : null }))}
               uploading={uploading}
               onUpload={async (file) => {
                 setUploading(true);
-                const url = await uploadImage(file, 'products');
+                const uploaded = await uploadImage(file, 'products');
                 setUploading(false);
-                return url;
+                if (uploaded) setForm(f => ({ ...f, image_url: uploaded.url, image_variants: uploaded.image_variants }));
+                return uploaded?.url ?? null;
               }}
             />
           </div>
@@ -1,6 +1,13 @@
 export const ADMIN_URL = 'https://functions.poehali.dev/7f596fac-a8fe-498a-bf36-7bfa5c3c69c5';
 export const UPLOAD_URL = 'https://functions.poehali.dev/e6b8ed0a-5d91-4a0e-b345-ce02226791ef';
 
+export type ImageVariants = Record<string, unknown>;
+
+export interface UploadedImage {
+  url: string;
+  image_variants: ImageVariants | null;
+}
+
 export interface Category {
   id: number;
   slug: string;
@@ -10,6 +17,7 @@ export interface Category {
   sort_order: number;
   is_active: boolean;
   product_count: number;
+  image_variants: ImageVariants | null;
 }
 
 export interface Product {
@@ -25,7 +33,8 @@ export interface Product {
   sort_order: number;
   sku: string | null;
   specifications: Record<string, string> | null;
+  image_variants: ImageVariants | null;
 }
 
 export type ApiCall = (method: string, resource: string, body?: object, id?: number | string) => Promise<Record<string, unknown>>;
-export type UploadImage = (file: File, folder: string) => Promise<string | null>;
\ No newline at end of file
+export type UploadImage = (file: File, folder: string) => Promise<UploadedImage | null>;
\ No newline at end of file